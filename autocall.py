@@ -0,0 +1,110 @@
+"""種類ごとの自動呼出（スタッフ操作なしで待ち行列を進める）。
+
+reservation_types の auto_call_mode / auto_call_value に従って呼出す人数を決める。
+- keep_called: 呼出中（called）の人数が auto_call_value 人になるまで呼ぶ。
+  called_timeout_seconds より前に呼ばれて到着していない人は来ないものとみなして数えない
+  （数えると、来ない人が数人いるだけで列が止まるため）
+- interval: auto_call_value 分ごとに1人呼ぶ
+
+gunicorn の各ワーカーが run_leader_loop を動かし、advisory lock を取れた1プロセスだけが
+実際に呼出を行う。対象行は FOR UPDATE SKIP LOCKED で確保し、batch_size 件ずつコミットしてから通知する。
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from storage import AUTO_CALL_MODES
+
+logger = logging.getLogger(__name__)
+
+
+def calls_due(mode: str, value: int, called_count: int, seconds_since_last) -> int:
+    if mode == "keep_called":
+        return max(0, value - called_count)
+    if mode == "interval":
+        if seconds_since_last is None or seconds_since_last >= value * 60:
+            return 1
+    return 0
+
+
+class AutoCaller:
+    def __init__(self, storage, push, batch_size: int = 50, push_concurrency: int = 4,
+                 called_timeout_seconds: float = 600):
+        """push(user_id, res_id) は確保済みの予約への通知。失敗しても呼出状態は戻さない。"""
+        self.storage = storage
+        self.push = push
+        self.called_timeout_seconds = called_timeout_seconds
+        self.batch_size = max(1, batch_size)
+        self._executor = ThreadPoolExecutor(push_concurrency, "auto-call-push") if push_concurrency > 1 else None
+
+    def tick(self) -> int:
+        """1回分の自動呼出を行い、呼出した件数を返す。"""
+        with self.storage.transaction() as tx:
+            plan = tx.auto_call_plan(self.called_timeout_seconds)
+        total = 0
+        for type_id, mode, value, called_count, seconds_since_last in plan:
+            if mode not in AUTO_CALL_MODES:
+                continue
+            remaining = calls_due(mode, value, called_count, seconds_since_last)
+            while remaining > 0:
+                limit = min(remaining, self.batch_size)
+                with self.storage.transaction() as tx:
+                    claimed = tx.claim_waiting(type_id, limit)
+                    if claimed and mode == "interval":
+                        tx.mark_auto_called(type_id)
+                self._push_batch(claimed)
+                total += len(claimed)
+                remaining -= len(claimed)
+                if len(claimed) < limit:
+                    break
+        return total
+
+    def _push_batch(self, claimed):
+        if self._executor is None:
+            for res_id, user_id in claimed:
+                self._push_one(user_id, res_id)
+            return
+        list(self._executor.map(lambda row: self._push_one(row[1], row[0]), claimed))
+
+    def _push_one(self, user_id, res_id):
+        try:
+            self.push(user_id, res_id)
+        except Exception:
+            logger.exception("Failed to send auto-call push for reservation %s", res_id)
+
+
+def run_leader_loop(caller: AutoCaller, lock_key: int, tick_seconds: float, retry_seconds: float,
+                    stop_event: threading.Event):
+    """リーダーでない間は retry_seconds ごとにだけロック取得を試みる。"""
+    lock = caller.storage.leader_lock(lock_key)
+    next_attempt = 0.0
+    while not stop_event.is_set():
+        try:
+            if not lock.held and time.monotonic() >= next_attempt:
+                next_attempt = time.monotonic() + retry_seconds
+                if lock.try_acquire():
+                    logger.info("Auto-call leader lock acquired")
+            if lock.held:
+                if lock.is_held():
+                    caller.tick()
+                else:
+                    logger.warning("Auto-call leader lock lost")
+        except Exception:
+            logger.exception("Auto-call tick failed")
+        stop_event.wait(tick_seconds)
+    lock.release()
+
+
+def start_auto_caller(caller: AutoCaller, lock_key: int, tick_seconds: float,
+                      retry_seconds: float) -> threading.Event:
+    """デーモンスレッドでリーダーループを開始し、停止用の Event を返す。"""
+    stop_event = threading.Event()
+    thread = threading.Thread(
+        target=run_leader_loop,
+        args=(caller, lock_key, tick_seconds, retry_seconds, stop_event),
+        name="auto-caller",
+        daemon=True,
+    )
+    thread.start()
+    return stop_event
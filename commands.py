@@ -0,0 +1,107 @@
+import os
+import re
+
+MAX_TYPE_NAME_LENGTH = int(os.getenv("MAX_TYPE_NAME_LENGTH", "40"))
+MAX_USER_MESSAGE_CHARS = int(os.getenv("MAX_USER_MESSAGE_CHARS", "100"))
+TYPE_NAME_PATTERN = re.compile(
+    rf"^[A-Za-z0-9ぁ-んァ-ヶー一-龠々・ 　_-]{{1,{MAX_TYPE_NAME_LENGTH}}}$"
+)
+
+HELP_MESSAGE = "メッセージを受け付けました。予約は「予約」、キャンセルは「キャンセル」、到着は「到着」と送信してください。"
+
+
+def call_message(res_id: int) -> str:
+    return f"【順番が来ました】番号 {res_id} 番の方、会場へお越しください！"
+
+
+def normalize_type_name(value: str) -> str:
+    return " ".join((value or "").split())
+
+
+def validate_type_name(value: str) -> bool:
+    if not value or len(value) > MAX_TYPE_NAME_LENGTH:
+        return False
+    return bool(TYPE_NAME_PATTERN.fullmatch(value))
+
+
+def is_reservation_command(normalized: str) -> bool:
+    return normalized.startswith('予約') or normalized in ('キャンセル', '到着')
+
+
+def precheck_message(normalized: str):
+    """ストレージを使わずに返せる応答。ストレージが必要なコマンドなら None。"""
+    if not normalized:
+        return HELP_MESSAGE
+    if len(normalized) > MAX_USER_MESSAGE_CHARS:
+        return f"メッセージは{MAX_USER_MESSAGE_CHARS}文字以内で送信してください。"
+    if not is_reservation_command(normalized):
+        return HELP_MESSAGE
+    return None
+
+
+def run_command(tx, user_id: str, user_message: str, normalized: str) -> str:
+    """予約 / キャンセル / 到着 をトランザクション tx 上で処理し、返信文を返す。"""
+    if normalized.startswith('予約'):
+        return reserve(tx, user_id, user_message, normalized)
+    if normalized == 'キャンセル':
+        cancelled = tx.cancel_latest(user_id)
+        if cancelled:
+            return f"予約番号 {cancelled} をキャンセルしました。"
+        return "キャンセル対象の予約はありません。"
+    if normalized == '到着':
+        existing = tx.latest_pending_for_user(user_id)
+        if not existing:
+            return "到着の対象となる予約がありません。"
+        res_id, status = existing
+        if status == 'waiting':
+            return "まだ呼出されていません。呼出後に「到着」と送信してください。"
+        tx.mark_arrived(res_id)
+        return f"到着を受け付けました。番号: {res_id} / スタッフが確認します。"
+    return HELP_MESSAGE
+
+
+def reserve(tx, user_id: str, user_message: str, normalized: str) -> str:
+    if not tx.is_accepting_new():
+        return "現在、新規の予約受付は停止中です。"
+    requested_type_name = normalize_type_name(normalized[2:])
+    if not requested_type_name:
+        names = tx.accepting_type_names()
+        if names:
+            return "予約の種類を指定してください。\n利用可能: " + " / ".join(names) + "\n例: 予約 相談"
+        return "現在受付可能な予約の種類がありません。管理画面で受付を再開してください。"
+    if not validate_type_name(requested_type_name):
+        return (
+            f"種類名は1〜{MAX_TYPE_NAME_LENGTH}文字で指定してください。"
+            "\n例: 予約 相談"
+        )
+    type_row = tx.get_type_by_name(requested_type_name)
+    if not type_row:
+        names = tx.accepting_type_names()
+        if names:
+            return f"指定した種類「{requested_type_name}」は存在しません。\n利用可能: " + " / ".join(names)
+        return "予約の種類がまだ登録されていません。管理画面で追加してください。"
+    type_id, type_name, type_accepting = type_row
+    if not type_accepting:
+        names = tx.accepting_type_names()
+        if names:
+            return f"「{type_name}」の新規受付は停止中です。\n利用可能: " + " / ".join(names)
+        return f"「{type_name}」の新規受付は停止中です。"
+
+    existing = tx.latest_active_for_user(user_id)
+    if existing:
+        res_id, status, existing_type_id, existing_type_name = existing
+        if status == 'waiting':
+            if existing_type_name:
+                waiting = tx.count_waiting_ahead(res_id, existing_type_id)
+                return f"予約済みです。番号: {res_id} / 種類: {existing_type_name} / 待ち: {waiting}人"
+            return f"予約済みです。番号: {res_id} / 待ち: {tx.count_waiting_ahead(res_id)}人"
+        if status == 'called':
+            if existing_type_name:
+                return f"【呼出中】番号: {res_id} / 種類: {existing_type_name} 会場へお越しください！"
+            return f"【呼出中】番号: {res_id} 会場へお越しください！"
+        if existing_type_name:
+            return f"到着受付済みです。番号: {res_id} / 種類: {existing_type_name} / スタッフが確認します。"
+        return f"到着受付済みです。番号: {res_id} / スタッフが確認します。"
+
+    new_id = tx.create_reservation(user_id, user_message, type_id)
+    return f"【受付完了】番号: {new_id} / 種類: {type_name} / 待ち: {tx.count_waiting_ahead(new_id, type_id)}人"
@@ -1,18 +1,44 @@
+import json
 import os
-import re
 import secrets
+import sys
+import tempfile
+import threading
 import time
 from datetime import timedelta
 from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
 
-import psycopg2
-from flask import Flask, request, abort, render_template, redirect, url_for, session, jsonify
+from flask import Flask, Response, request, abort, render_template, redirect, url_for, session, jsonify
 from linebot import LineBotApi, WebhookHandler
 from linebot.exceptions import InvalidSignatureError
 from linebot.models import MessageEvent, TextMessage, TextSendMessage
 from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.security import check_password_hash
 
+try:
+    import fcntl
+except ImportError:  # Windows等ではワーカー間で共有せず、プロセス内のセマフォで代用する
+    fcntl = None
+
+from autocall import AutoCaller, start_auto_caller
+from commands import (
+    MAX_TYPE_NAME_LENGTH,
+    call_message,
+    normalize_type_name,
+    precheck_message,
+    run_command,
+    validate_type_name,
+)
+from profiling import SamplingProfiler, TraceRecorder, instrument_signature_validator, span
+from storage import (
+    ACTIVE_STATUSES,
+    AUTO_CALL_MODES,
+    HISTORY_STATUSES,
+    SORT_COLUMNS,
+    DuplicateTypeError,
+    create_storage,
+)
+
 app = Flask(__name__)
 app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1)
 
@@ -56,10 +82,20 @@ CHANNEL_SECRET = (os.getenv('CHANNEL_SECRET') or "").strip()
 if not CHANNEL_ACCESS_TOKEN or not CHANNEL_SECRET:
     raise RuntimeError("CHANNEL_ACCESS_TOKEN and CHANNEL_SECRET are required")
 
+# memory はDBなしのオフライン検証用（プロセス内のみ・再起動で消える）
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "postgres").strip().lower()
 raw_db_url = (os.getenv('DATABASE_URL') or "").strip()
-if not raw_db_url:
+if STORAGE_BACKEND == "postgres" and not raw_db_url:
     raise RuntimeError("DATABASE_URL is required")
-DATABASE_URL = normalize_db_url(raw_db_url)
+# memory はワーカーごとに別のストアになり、予約が管理画面に出ない・自動呼出のリーダーが複数になる。
+# gunicorn（Procfile）では WEB_CONCURRENCY=1 のときだけ起動を許可する。
+if (
+    STORAGE_BACKEND == "memory"
+    and "gunicorn" in sys.modules
+    and int(os.getenv("WEB_CONCURRENCY", "2")) != 1
+):
+    raise RuntimeError("STORAGE_BACKEND=memory requires a single worker (set WEB_CONCURRENCY=1)")
+DATABASE_URL = normalize_db_url(raw_db_url) if raw_db_url else ""
 DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "5"))
 
 OWNER_LINE_ID = os.getenv('OWNER_LINE_ID', '').strip()
@@ -68,15 +104,53 @@ ALLOWED_HOSTS = {
     host.strip().lower() for host in os.getenv("ALLOWED_HOSTS", "").split(",") if host.strip()
 }
 SESSION_IDLE_TIMEOUT_SECONDS = int(os.getenv("SESSION_IDLE_TIMEOUT_SECONDS", "1800"))
-MAX_TYPE_NAME_LENGTH = int(os.getenv("MAX_TYPE_NAME_LENGTH", "40"))
-MAX_USER_MESSAGE_CHARS = int(os.getenv("MAX_USER_MESSAGE_CHARS", "100"))
-TYPE_NAME_PATTERN = re.compile(
-    rf"^[A-Za-z0-9ぁ-んァ-ヶー一-龠々・ 　_-]{{1,{MAX_TYPE_NAME_LENGTH}}}$"
+# ポーリング系APIでは最終操作時刻の更新をこの間隔に間引き、Cookieの再署名・再送を抑える。
+# アイドルタイムアウトより長いと操作中でも失効しうるため、その半分を上限とする。
+SESSION_ACTIVITY_UPDATE_INTERVAL_SECONDS = min(
+    int(os.getenv("SESSION_ACTIVITY_UPDATE_INTERVAL_SECONDS", "60")),
+    SESSION_IDLE_TIMEOUT_SECONDS // 2,
 )
 
 WEBHOOK_RATE_LIMIT_COUNT = int(os.getenv("WEBHOOK_RATE_LIMIT_COUNT", "120"))
 WEBHOOK_RATE_LIMIT_WINDOW_SECONDS = int(os.getenv("WEBHOOK_RATE_LIMIT_WINDOW_SECONDS", "60"))
 WEBHOOK_REQUESTS = {}
+WEBHOOK_REQUESTS_LOCK = threading.Lock()
+# DBを使うWebhook処理の同時実行数（同一ホスト上の全ワーカー合計）。超過分はDBに触れず混雑応答を返す。
+# 枠は WEBHOOK_ADMISSION_DIR 内のロックファイルへの flock で表し、ワーカーが落ちても枠は自動で解放される。
+WEBHOOK_MAX_CONCURRENCY = max(1, int(os.getenv("WEBHOOK_MAX_CONCURRENCY", "4")))
+WEBHOOK_ADMISSION_WAIT_SECONDS = float(os.getenv("WEBHOOK_ADMISSION_WAIT_SECONDS", "0"))
+WEBHOOK_ADMISSION_DIR = (
+    os.getenv("WEBHOOK_ADMISSION_DIR") or os.path.join(tempfile.gettempdir(), "linebot-webhook-slots")
+)
+WEBHOOK_BUSY_MESSAGE = "ただいま混雑しています。しばらくしてから、もう一度送信してください。"
+# 混雑応答を返した件数のログ出力間隔（急増時にログが溢れないよう間引く）
+WEBHOOK_SHED_LOG_INTERVAL_SECONDS = float(os.getenv("WEBHOOK_SHED_LOG_INTERVAL_SECONDS", "10"))
+WEBHOOK_ADMISSION = threading.BoundedSemaphore(WEBHOOK_MAX_CONCURRENCY)
+os.makedirs(WEBHOOK_ADMISSION_DIR, mode=0o700, exist_ok=True)
+WEBHOOK_ADMISSION_LOCK = threading.Lock()
+# このワーカーのカウンタ。WEBHOOK_ADMISSION_DIR の stats-<pid>.json にも書き出し、集計は全ワーカー分を合算する。
+WEBHOOK_ADMISSION_STATS = {"in_flight": 0, "peak_in_flight": 0, "admitted": 0, "shed": 0}
+WEBHOOK_SHED_LOG = {"logged_at": 0.0, "unlogged": 0}
+
+# プロファイリング（管理画面 /admin/profile から操作。ワーカープロセスごと）
+PROFILING_TRACE_ENABLED = parse_bool_env("PROFILING_TRACE_ENABLED", True)
+PROFILING_TRACE_BUFFER = int(os.getenv("PROFILING_TRACE_BUFFER", "200"))
+PROFILING_MAX_SECONDS = int(os.getenv("PROFILING_MAX_SECONDS", "120"))
+PROFILING_SAMPLE_INTERVAL_SECONDS = float(os.getenv("PROFILING_SAMPLE_INTERVAL_SECONDS", "0.01"))
+# 採取結果の置き場所。全ワーカーから読めるよう同一ホスト上の共有ディレクトリにする。
+PROFILING_OUTPUT_DIR = os.getenv("PROFILING_OUTPUT_DIR") or os.path.join(tempfile.gettempdir(), "linebot-profiles")
+
+# 自動呼出（種類ごとの設定は管理画面 /admin/types）。全ワーカーのうちadvisory lockを取れた1つだけが実行する。
+AUTO_CALL_ENABLED = parse_bool_env("AUTO_CALL_ENABLED", False)
+AUTO_CALL_TICK_SECONDS = float(os.getenv("AUTO_CALL_TICK_SECONDS", "5"))
+AUTO_CALL_BATCH_SIZE = int(os.getenv("AUTO_CALL_BATCH_SIZE", "50"))
+AUTO_CALL_PUSH_CONCURRENCY = int(os.getenv("AUTO_CALL_PUSH_CONCURRENCY", "4"))
+AUTO_CALL_LOCK_KEY = int(os.getenv("AUTO_CALL_LOCK_KEY", "724001"))
+# リーダーでないワーカーがロック取得を再試行する間隔（リーダー交代までの最大待ち時間）
+AUTO_CALL_LEADER_RETRY_SECONDS = float(os.getenv("AUTO_CALL_LEADER_RETRY_SECONDS", "60"))
+AUTO_CALL_MAX_VALUE = 1000
+# keep_called で、呼出からこの分数を過ぎても到着しない人は「呼出中」に数えない（0で無効）
+AUTO_CALL_CALLED_TIMEOUT_MINUTES = float(os.getenv("AUTO_CALL_CALLED_TIMEOUT_MINUTES", "10"))
 
 app.config.update(
     SESSION_COOKIE_HTTPONLY=True,
@@ -84,14 +158,54 @@ app.config.update(
     SESSION_COOKIE_SECURE=parse_bool_env("SESSION_COOKIE_SECURE", True),
     SESSION_COOKIE_NAME="__Host-session" if parse_bool_env("SESSION_COOKIE_SECURE", True) else "session",
     PERMANENT_SESSION_LIFETIME=timedelta(seconds=SESSION_IDLE_TIMEOUT_SECONDS),
+    # 変更がない限りCookieを再発行しない（有効期限は最終操作時刻の更新で延長される）
+    SESSION_REFRESH_EACH_REQUEST=False,
 )
 app.jinja_env.autoescape = True
 
 line_bot_api = LineBotApi(CHANNEL_ACCESS_TOKEN)
 handler = WebhookHandler(CHANNEL_SECRET)
-
-def get_connection():
-    return psycopg2.connect(DATABASE_URL, connect_timeout=DB_CONNECT_TIMEOUT)
+storage = create_storage(STORAGE_BACKEND, DATABASE_URL, DB_CONNECT_TIMEOUT)
+
+profiler = SamplingProfiler(PROFILING_OUTPUT_DIR, PROFILING_SAMPLE_INTERVAL_SECONDS)
+traces = TraceRecorder(PROFILING_TRACE_BUFFER)
+traces.enabled = PROFILING_TRACE_ENABLED
+instrument_signature_validator(handler)
+
+if PROFILING_TRACE_ENABLED:
+    # ルート別の所要時間。未処理例外で500になったリクエストも teardown で記録される。
+    _untimed_wsgi_app = app.wsgi_app
+
+    def timed_wsgi_app(environ, start_response):
+        environ["linebot.request_started"] = time.perf_counter()
+        return _untimed_wsgi_app(environ, start_response)
+
+    app.wsgi_app = timed_wsgi_app
+
+    @app.teardown_request
+    def record_route_timing(exc):
+        started = request.environ.get("linebot.request_started")
+        if started is not None:
+            traces.record_route(request.endpoint or "<unmatched>", (time.perf_counter() - started) * 1000)
+
+
+def push_call_message(user_id, res_id):
+    line_bot_api.push_message(user_id, TextSendMessage(text=call_message(res_id)))
+
+
+if AUTO_CALL_ENABLED:
+    start_auto_caller(
+        AutoCaller(
+            storage,
+            push_call_message,
+            AUTO_CALL_BATCH_SIZE,
+            AUTO_CALL_PUSH_CONCURRENCY,
+            AUTO_CALL_CALLED_TIMEOUT_MINUTES * 60,
+        ),
+        AUTO_CALL_LOCK_KEY,
+        AUTO_CALL_TICK_SECONDS,
+        AUTO_CALL_LEADER_RETRY_SECONDS,
+    )
 
 def verify_admin_password(candidate: str) -> bool:
     if not candidate:
@@ -136,7 +250,7 @@ def start_admin_session():
     session.permanent = True
 
 
-def is_admin_authenticated(update_activity: bool = True) -> bool:
+def is_admin_authenticated(update_activity: bool = True, min_update_interval: int = 0) -> bool:
     if not session.get("logged_in"):
         return False
     last_activity = session.get("last_activity")
@@ -147,20 +261,15 @@ def is_admin_authenticated(update_activity: bool = True) -> bool:
     if now - last_activity > SESSION_IDLE_TIMEOUT_SECONDS:
         session.clear()
         return False
-    if update_activity:
+    if update_activity and now - last_activity >= min_update_interval:
         session["last_activity"] = now
         session.modified = True
     return True
 
 
-def normalize_type_name(value: str) -> str:
-    return " ".join((value or "").split())
-
+def is_admin_polling_authenticated() -> bool:
+    return is_admin_authenticated(min_update_interval=SESSION_ACTIVITY_UPDATE_INTERVAL_SECONDS)
 
-def validate_type_name(value: str) -> bool:
-    if not value or len(value) > MAX_TYPE_NAME_LENGTH:
-        return False
-    return bool(TYPE_NAME_PATTERN.fullmatch(value))
 
 def get_csrf_token() -> str:
     token = session.get("_csrf_token")
@@ -192,9 +301,8 @@ def csrf_protect():
         validate_csrf()
 
 
-@app.after_request
-def apply_security_headers(response):
-    csp = (
+SECURITY_HEADERS = {
+    "Content-Security-Policy": (
         "default-src 'self'; "
         "script-src 'self'; "
         "style-src 'self' https://cdn.jsdelivr.net; "
@@ -203,12 +311,18 @@ def apply_security_headers(response):
         "frame-ancestors 'none'; "
         "base-uri 'self'; "
         "form-action 'self'"
-    )
-    response.headers.setdefault("Content-Security-Policy", csp)
-    response.headers.setdefault("X-Content-Type-Options", "nosniff")
-    response.headers.setdefault("X-Frame-Options", "DENY")
-    response.headers.setdefault("Referrer-Policy", "no-referrer")
-    response.headers.setdefault("Permissions-Policy", "camera=(), microphone=(), geolocation=()")
+    ),
+    "X-Content-Type-Options": "nosniff",
+    "X-Frame-Options": "DENY",
+    "Referrer-Policy": "no-referrer",
+    "Permissions-Policy": "camera=(), microphone=(), geolocation=()",
+}
+
+
+@app.after_request
+def apply_security_headers(response):
+    for name, value in SECURITY_HEADERS.items():
+        response.headers.setdefault(name, value)
     forwarded_proto = (request.headers.get("X-Forwarded-Proto") or "").split(",")[0].strip().lower()
     if FORCE_HTTPS and (request.is_secure or forwarded_proto == "https"):
         response.headers.setdefault("Strict-Transport-Security", "max-age=31536000; includeSubDomains")
@@ -218,30 +332,185 @@ def apply_security_headers(response):
     return response
 
 LOGIN_ATTEMPTS = {}
+LOGIN_ATTEMPTS_LOCK = threading.Lock()
 LOGIN_MAX_ATTEMPTS = int(os.getenv("LOGIN_MAX_ATTEMPTS", "10"))
 LOGIN_WINDOW_SECONDS = int(os.getenv("LOGIN_WINDOW_SECONDS", "300"))
 
 def is_login_rate_limited(ip: str) -> bool:
+    """制限内なら試行を記録して False を返す（判定と記録を同じロック内で行い、同時送信でも上限を超えない）。"""
     now = time.time()
     window_start = now - LOGIN_WINDOW_SECONDS
-    attempts = [t for t in LOGIN_ATTEMPTS.get(ip, []) if t > window_start]
-    LOGIN_ATTEMPTS[ip] = attempts
-    return len(attempts) >= LOGIN_MAX_ATTEMPTS
+    with LOGIN_ATTEMPTS_LOCK:
+        attempts = [t for t in LOGIN_ATTEMPTS.get(ip, []) if t > window_start]
+        LOGIN_ATTEMPTS[ip] = attempts
+        if len(attempts) >= LOGIN_MAX_ATTEMPTS:
+            return True
+        attempts.append(now)
+    return False
 
-def record_login_failure(ip: str):
-    LOGIN_ATTEMPTS.setdefault(ip, []).append(time.time())
+def clear_login_attempts(ip: str):
+    with LOGIN_ATTEMPTS_LOCK:
+        LOGIN_ATTEMPTS.pop(ip, None)
 
 
 def is_webhook_rate_limited(ip: str) -> bool:
     now = time.time()
     window_start = now - WEBHOOK_RATE_LIMIT_WINDOW_SECONDS
-    attempts = [t for t in WEBHOOK_REQUESTS.get(ip, []) if t > window_start]
-    WEBHOOK_REQUESTS[ip] = attempts
-    if len(attempts) >= WEBHOOK_RATE_LIMIT_COUNT:
-        return True
-    WEBHOOK_REQUESTS[ip].append(now)
+    with WEBHOOK_REQUESTS_LOCK:
+        attempts = [t for t in WEBHOOK_REQUESTS.get(ip, []) if t > window_start]
+        WEBHOOK_REQUESTS[ip] = attempts
+        if len(attempts) >= WEBHOOK_RATE_LIMIT_COUNT:
+            return True
+        attempts.append(now)
     return False
 
+
+def open_in_admission_dir(name: str, flags: int) -> int:
+    path = os.path.join(WEBHOOK_ADMISSION_DIR, name)
+    try:
+        return os.open(path, flags, 0o600)
+    except FileNotFoundError:
+        # /tmp の定期掃除などでディレクトリごと消えた場合は作り直す
+        os.makedirs(WEBHOOK_ADMISSION_DIR, mode=0o700, exist_ok=True)
+        return os.open(path, flags, 0o600)
+
+
+def lock_webhook_slot():
+    """空いている枠を1つロックして返す。満杯、または枠を開けないときは None（混雑応答になる）。"""
+    if fcntl is None:
+        return -1 if WEBHOOK_ADMISSION.acquire(blocking=False) else None
+    start = secrets.randbelow(WEBHOOK_MAX_CONCURRENCY)
+    for i in range(WEBHOOK_MAX_CONCURRENCY):
+        name = f"slot-{(start + i) % WEBHOOK_MAX_CONCURRENCY}.lock"
+        try:
+            fd = open_in_admission_dir(name, os.O_RDWR | os.O_CREAT)
+        except OSError:
+            app.logger.exception("Failed to open webhook admission slot %s", name)
+            return None
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return fd
+        except BlockingIOError:
+            os.close(fd)
+    return None
+
+
+def acquire_webhook_slot():
+    """枠を確保して処理中として数える。release_webhook と対で使う。"""
+    slot = lock_webhook_slot()
+    if slot is None:
+        return None
+    with WEBHOOK_ADMISSION_LOCK:
+        WEBHOOK_ADMISSION_STATS["admitted"] += 1
+        WEBHOOK_ADMISSION_STATS["in_flight"] += 1
+        WEBHOOK_ADMISSION_STATS["peak_in_flight"] = max(
+            WEBHOOK_ADMISSION_STATS["peak_in_flight"], WEBHOOK_ADMISSION_STATS["in_flight"]
+        )
+        write_webhook_admission_stats()
+    return slot
+
+
+def try_admit_webhook():
+    """枠を確保できたらその枠（release_webhook に渡す）を、混雑時は None を返す。"""
+    deadline = time.monotonic() + WEBHOOK_ADMISSION_WAIT_SECONDS
+    slot = acquire_webhook_slot()
+    while slot is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+        slot = acquire_webhook_slot()
+    if slot is None:
+        record_webhook_shed()
+    return slot
+
+
+def record_webhook_shed():
+    now = time.monotonic()
+    with WEBHOOK_ADMISSION_LOCK:
+        WEBHOOK_ADMISSION_STATS["shed"] += 1
+        write_webhook_admission_stats()
+        WEBHOOK_SHED_LOG["unlogged"] += 1
+        if now - WEBHOOK_SHED_LOG["logged_at"] < WEBHOOK_SHED_LOG_INTERVAL_SECONDS:
+            return
+        shed, WEBHOOK_SHED_LOG["unlogged"] = WEBHOOK_SHED_LOG["unlogged"], 0
+        WEBHOOK_SHED_LOG["logged_at"] = now
+    app.logger.warning(
+        "Webhook admission shed %s request(s) since last report (max_concurrency=%s, pid %s)",
+        shed, WEBHOOK_MAX_CONCURRENCY, os.getpid(),
+    )
+
+
+def write_webhook_admission_stats():
+    """このワーカーのカウンタを stats-<pid>.json に書き出す。WEBHOOK_ADMISSION_LOCK を保持して呼ぶ。"""
+    name = f"stats-{os.getpid()}.json"
+    path = os.path.join(WEBHOOK_ADMISSION_DIR, name)
+    try:
+        fd = open_in_admission_dir(f"{name}.tmp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+        with open(fd, "w", encoding="utf-8") as f:
+            json.dump(dict(WEBHOOK_ADMISSION_STATS, pid=os.getpid(), updated_at=time.time()), f)
+        os.replace(f"{path}.tmp", path)
+    except OSError:
+        app.logger.exception("Failed to write webhook admission stats to %s", path)
+
+
+def is_process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def read_webhook_admission_stats() -> dict:
+    """WEBHOOK_ADMISSION_DIR にある全ワーカーのカウンタ（pid -> dict）。"""
+    workers = {}
+    try:
+        names = os.listdir(WEBHOOK_ADMISSION_DIR)
+    except OSError:
+        return workers
+    for name in names:
+        if not (name.startswith("stats-") and name.endswith(".json")):
+            continue
+        try:
+            with open(os.path.join(WEBHOOK_ADMISSION_DIR, name), encoding="utf-8") as f:
+                stats = json.load(f)
+        except (OSError, ValueError):
+            continue
+        stats["alive"] = is_process_alive(stats["pid"])
+        if not stats["alive"]:
+            # 落ちたワーカーの枠は flock とともに解放済み
+            stats["in_flight"] = 0
+        workers[stats["pid"]] = stats
+    return workers
+
+
+def release_webhook(slot):
+    with WEBHOOK_ADMISSION_LOCK:
+        WEBHOOK_ADMISSION_STATS["in_flight"] -= 1
+        write_webhook_admission_stats()
+    if slot == -1:
+        WEBHOOK_ADMISSION.release()
+    else:
+        # close で flock も解放される
+        os.close(slot)
+
+
+def get_webhook_admission_stats() -> dict:
+    """全ワーカーの合計。admitted / shed は落ちたワーカーの分も含む累計。"""
+    workers = read_webhook_admission_stats()
+    with WEBHOOK_ADMISSION_LOCK:
+        workers[os.getpid()] = dict(WEBHOOK_ADMISSION_STATS, pid=os.getpid(), updated_at=time.time(), alive=True)
+    stats = {key: sum(w[key] for w in workers.values()) for key in ("admitted", "shed", "in_flight")}
+    # 各ワーカーの最大値は同時刻とは限らないため、合計は上限値（ホスト共有の枠数で頭打ち）
+    stats["peak_in_flight"] = sum(w["peak_in_flight"] for w in workers.values())
+    if fcntl is not None:
+        stats["peak_in_flight"] = min(stats["peak_in_flight"], WEBHOOK_MAX_CONCURRENCY)
+    stats["max_concurrency"] = WEBHOOK_MAX_CONCURRENCY
+    stats["scope"] = "host" if fcntl is not None else "process"
+    stats["pid"] = os.getpid()
+    stats["workers"] = sorted(workers.values(), key=lambda w: w["pid"])
+    return stats
+
 # --- ルーティング ---
 
 @app.route("/")
@@ -257,69 +526,12 @@ def login():
             abort(429)
         if verify_admin_password(request.form.get("password")):
             start_admin_session()
-            LOGIN_ATTEMPTS.pop(ip, None)
+            clear_login_attempts(ip)
             return redirect(url_for("admin_page"))
         else:
-            record_login_failure(ip)
             error = "パスワードが正しくありません"
     return render_template("login.html", error=error, csrf_token=get_csrf_token())
 
-def ensure_types_table():
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS reservation_types (
-                    id SERIAL PRIMARY KEY,
-                    name TEXT NOT NULL UNIQUE,
-                    accepting BOOLEAN NOT NULL DEFAULT TRUE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            cur.execute("""
-                ALTER TABLE reservations
-                ADD COLUMN IF NOT EXISTS type_id INTEGER
-                REFERENCES reservation_types(id) ON DELETE SET NULL
-            """)
-            cur.execute("""
-                ALTER TABLE reservation_types
-                ADD COLUMN IF NOT EXISTS accepting BOOLEAN NOT NULL DEFAULT TRUE
-            """)
-            conn.commit()
-
-def ensure_settings_table():
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS app_settings (
-                    key TEXT PRIMARY KEY,
-                    value TEXT NOT NULL
-                )
-            """)
-            cur.execute("""
-                INSERT INTO app_settings (key, value)
-                VALUES ('accepting_new', 'true')
-                ON CONFLICT (key) DO NOTHING
-            """)
-            conn.commit()
-
-def is_accepting_new():
-    ensure_settings_table()
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute("SELECT value FROM app_settings WHERE key = 'accepting_new'")
-            row = cur.fetchone()
-            return (row and row[0] == 'true')
-
-def set_accepting_new(flag: bool):
-    ensure_settings_table()
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                "UPDATE app_settings SET value = %s WHERE key = 'accepting_new'",
-                ('true' if flag else 'false',)
-            )
-            conn.commit()
-
 @app.route("/logout", methods=["POST"])
 def logout():
     session.clear()
@@ -330,51 +542,21 @@ def admin_page():
     if not is_admin_authenticated():
         return redirect(url_for("login"))
 
-    ensure_types_table()
     type_error = request.args.get("type_error")
     type_id = request.args.get("type_id", "").strip()
     current_type_id = int(type_id) if type_id.isdigit() else None
     sort_by = request.args.get("sort_by", "id").strip()
     sort_order = request.args.get("sort_order", "asc").strip().lower()
-    if sort_by not in ("id", "status", "type", "message"):
+    if sort_by not in SORT_COLUMNS:
         sort_by = "id"
     if sort_order not in ("asc", "desc"):
         sort_order = "asc"
-    accepting_new = is_accepting_new()
-
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            params = []
-            where = "WHERE r.status IN ('waiting', 'called', 'arrived')"
-            if current_type_id is not None:
-                where += " AND r.type_id = %s"
-                params.append(current_type_id)
-            order_map = {
-                "id": "r.id",
-                "status": "r.status",
-                "type": "t.name",
-                "message": "r.message"
-            }
-            order_by = order_map[sort_by]
-            cur.execute(f"""
-                SELECT r.id, r.user_id, r.message, r.status, t.name
-                FROM reservations r
-                LEFT JOIN reservation_types t ON r.type_id = t.id
-                {where}
-                ORDER BY {order_by} {sort_order.upper()}, r.id ASC
-            """, params)
-            rows = cur.fetchall()
-            cur.execute("SELECT id, name FROM reservation_types ORDER BY id ASC")
-            types = cur.fetchall()
-            cur.execute("""
-                SELECT COALESCE(t.name, '未設定') AS name, COUNT(*)
-                FROM reservations r
-                LEFT JOIN reservation_types t ON r.type_id = t.id
-                WHERE r.status IN ('waiting', 'called', 'arrived')
-                GROUP BY COALESCE(t.name, '未設定')
-                ORDER BY COUNT(*) DESC
-            """)
-            type_counts = cur.fetchall()
+
+    with storage.transaction() as tx:
+        accepting_new = tx.is_accepting_new()
+        rows = tx.list_reservations(ACTIVE_STATUSES, current_type_id, sort_by, sort_order)
+        types = [(t[0], t[1]) for t in tx.list_types()]
+        type_counts = tx.active_type_counts()
     return render_template(
         "admin.html",
         rows=rows,
@@ -390,62 +572,33 @@ def admin_page():
 
 @app.route("/admin/data")
 def admin_data():
-    if not is_admin_authenticated():
+    if not is_admin_polling_authenticated():
         return jsonify({"error": "unauthorized"}), 401
 
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            type_id = request.args.get("type_id", "").strip()
-            current_type_id = int(type_id) if type_id.isdigit() else None
-            sort_by = request.args.get("sort_by", "id").strip()
-            sort_order = request.args.get("sort_order", "asc").strip().lower()
-            if sort_by not in ("id", "status", "type", "message"):
-                sort_by = "id"
-            if sort_order not in ("asc", "desc"):
-                sort_order = "asc"
-            params = []
-            where = "WHERE r.status IN ('waiting', 'called', 'arrived')"
-            if current_type_id is not None:
-                where += " AND r.type_id = %s"
-                params.append(current_type_id)
-            order_map = {
-                "id": "r.id",
-                "status": "r.status",
-                "type": "t.name",
-                "message": "r.message"
-            }
-            order_by = order_map[sort_by]
-            cur.execute(f"""
-                SELECT r.id, r.message, r.status, t.name
-                FROM reservations r
-                LEFT JOIN reservation_types t ON r.type_id = t.id
-                {where}
-                ORDER BY {order_by} {sort_order.upper()}, r.id ASC
-            """, params)
-            rows = cur.fetchall()
+    type_id = request.args.get("type_id", "").strip()
+    current_type_id = int(type_id) if type_id.isdigit() else None
+    sort_by = request.args.get("sort_by", "id").strip()
+    sort_order = request.args.get("sort_order", "asc").strip().lower()
+    if sort_by not in SORT_COLUMNS:
+        sort_by = "id"
+    if sort_order not in ("asc", "desc"):
+        sort_order = "asc"
+    with storage.transaction() as tx:
+        rows = tx.list_reservations(ACTIVE_STATUSES, current_type_id, sort_by, sort_order)
     return jsonify({
         "rows": [
-            {"id": row[0], "message": row[1], "status": row[2], "type": row[3]}
+            {"id": row[0], "message": row[2], "status": row[3], "type": row[4]}
             for row in rows
         ]
     })
 
 @app.route("/admin/type_counts")
 def admin_type_counts():
-    if not is_admin_authenticated():
+    if not is_admin_polling_authenticated():
         return jsonify({"error": "unauthorized"}), 401
 
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
-                SELECT COALESCE(t.name, '未設定') AS name, COUNT(*)
-                FROM reservations r
-                LEFT JOIN reservation_types t ON r.type_id = t.id
-                WHERE r.status IN ('waiting', 'called', 'arrived')
-                GROUP BY COALESCE(t.name, '未設定')
-                ORDER BY COUNT(*) DESC
-            """)
-            counts = cur.fetchall()
+    with storage.transaction() as tx:
+        counts = tx.active_type_counts()
     return jsonify({
         "counts": [
             {"name": row[0], "count": row[1]}
@@ -458,7 +611,6 @@ def admin_types_page():
     if not is_admin_authenticated():
         return redirect(url_for("login"))
 
-    ensure_types_table()
     type_error = request.args.get("type_error")
     type_success = request.args.get("type_success")
     if request.method == "POST":
@@ -471,23 +623,22 @@ def admin_types_page():
                 )
             )
         try:
-            with get_connection() as conn:
-                with conn.cursor() as cur:
-                    cur.execute("INSERT INTO reservation_types (name) VALUES (%s)", (name,))
-                    conn.commit()
+            with storage.transaction() as tx:
+                tx.add_type(name)
             return redirect(url_for("admin_types_page", type_success="種類を追加しました。"))
-        except psycopg2.IntegrityError:
+        except DuplicateTypeError:
             return redirect(url_for("admin_types_page", type_error="同じ名前の種類が既に存在します。"))
 
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute("SELECT id, name, accepting FROM reservation_types ORDER BY id ASC")
-            types = cur.fetchall()
+    with storage.transaction() as tx:
+        types = tx.list_types()
     return render_template(
         "types.html",
         types=types,
         type_error=type_error,
         type_success=type_success,
+        auto_call_enabled=AUTO_CALL_ENABLED,
+        auto_call_max_value=AUTO_CALL_MAX_VALUE,
+        auto_call_called_timeout_minutes=AUTO_CALL_CALLED_TIMEOUT_MINUTES,
         csrf_token=get_csrf_token()
     )
 
@@ -496,11 +647,8 @@ def admin_types_delete(type_id):
     if not is_admin_authenticated():
         return redirect(url_for("login"))
 
-    ensure_types_table()
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute("DELETE FROM reservation_types WHERE id = %s", (type_id,))
-            conn.commit()
+    with storage.transaction() as tx:
+        tx.delete_type(type_id)
     return redirect(url_for("admin_types_page"))
 
 @app.route("/admin/types/toggle/<int:type_id>", methods=["POST"])
@@ -508,51 +656,49 @@ def admin_types_toggle(type_id):
     if not is_admin_authenticated():
         return redirect(url_for("login"))
 
-    ensure_types_table()
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute("UPDATE reservation_types SET accepting = NOT accepting WHERE id = %s", (type_id,))
-            conn.commit()
+    with storage.transaction() as tx:
+        tx.toggle_type(type_id)
     return redirect(url_for("admin_types_page"))
 
+@app.route("/admin/types/auto_call/<int:type_id>", methods=["POST"])
+def admin_types_auto_call(type_id):
+    if not is_admin_authenticated():
+        return redirect(url_for("login"))
+
+    mode = request.form.get("mode", "off").strip()
+    value = request.form.get("value", "").strip()
+    if mode not in AUTO_CALL_MODES:
+        return redirect(url_for("admin_types_page", type_error="自動呼出の方式が不正です。"))
+    if mode == "off":
+        value = 0
+    elif value.isdigit() and 1 <= int(value) <= AUTO_CALL_MAX_VALUE:
+        value = int(value)
+    else:
+        return redirect(
+            url_for("admin_types_page", type_error=f"自動呼出の値は1〜{AUTO_CALL_MAX_VALUE}で指定してください。")
+        )
+    with storage.transaction() as tx:
+        tx.set_type_auto_call(type_id, mode, value)
+    return redirect(url_for("admin_types_page", type_success="自動呼出の設定を保存しました。"))
+
 @app.route("/admin/history")
 def admin_history():
     if not is_admin_authenticated():
         return redirect(url_for("login"))
 
-    ensure_types_table()
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            type_id = request.args.get("type_id", "").strip()
-            current_type_id = int(type_id) if type_id.isdigit() else None
-            sort_by = request.args.get("sort_by", "id").strip()
-            sort_order = request.args.get("sort_order", "desc").strip().lower()
-            if sort_by not in ("id", "status", "type", "message"):
-                sort_by = "id"
-            if sort_order not in ("asc", "desc"):
-                sort_order = "desc"
-            params = []
-            where = "WHERE r.status IN ('done', 'cancelled', 'arrived')"
-            if current_type_id is not None:
-                where += " AND r.type_id = %s"
-                params.append(current_type_id)
-            order_map = {
-                "id": "r.id",
-                "status": "r.status",
-                "type": "t.name",
-                "message": "r.message"
-            }
-            order_by = order_map[sort_by]
-            cur.execute(f"""
-                SELECT r.id, r.user_id, r.message, r.status, t.name
-                FROM reservations r
-                LEFT JOIN reservation_types t ON r.type_id = t.id
-                {where}
-                ORDER BY {order_by} {sort_order.upper()}, r.id DESC LIMIT 200
-            """, params)
-            rows = cur.fetchall()
-            cur.execute("SELECT id, name FROM reservation_types ORDER BY id ASC")
-            types = cur.fetchall()
+    type_id = request.args.get("type_id", "").strip()
+    current_type_id = int(type_id) if type_id.isdigit() else None
+    sort_by = request.args.get("sort_by", "id").strip()
+    sort_order = request.args.get("sort_order", "desc").strip().lower()
+    if sort_by not in SORT_COLUMNS:
+        sort_by = "id"
+    if sort_order not in ("asc", "desc"):
+        sort_order = "desc"
+    with storage.transaction() as tx:
+        rows = tx.list_reservations(
+            HISTORY_STATUSES, current_type_id, sort_by, sort_order, tie_order="desc", limit=200
+        )
+        types = [(t[0], t[1]) for t in tx.list_types()]
     return render_template(
         "history.html",
         rows=rows,
@@ -568,25 +714,14 @@ def admin_call(res_id):
     if not is_admin_authenticated():
         return redirect(url_for("login"))
 
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                "SELECT user_id FROM reservations WHERE id = %s AND status = 'waiting'",
-                (res_id,),
-            )
-            row = cur.fetchone()
-            if not row:
-                abort(404)
-            user_id = row[0]
-            cur.execute("UPDATE reservations SET status = 'called' WHERE id = %s", (res_id,))
-            conn.commit()
-            try:
-                line_bot_api.push_message(
-                    user_id,
-                    TextSendMessage(text=f"【順番が来ました】番号 {res_id} 番の方、会場へお越しください！"),
-                )
-            except Exception:
-                app.logger.exception("Failed to send LINE push message for reservation %s", res_id)
+    with storage.transaction() as tx:
+        user_id = tx.call_reservation(res_id)
+    if not user_id:
+        abort(404)
+    try:
+        push_call_message(user_id, res_id)
+    except Exception:
+        app.logger.exception("Failed to send LINE push message for reservation %s", res_id)
     return redirect(url_for("admin_page"))
 
 @app.route("/admin/finish/<int:res_id>", methods=["POST"])
@@ -594,38 +729,112 @@ def admin_finish(res_id):
     if not is_admin_authenticated():
         return redirect(url_for("login"))
 
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                "UPDATE reservations SET status = 'done' WHERE id = %s AND status = 'arrived' RETURNING id",
-                (res_id,),
-            )
-            if not cur.fetchone():
-                abort(404)
-            conn.commit()
+    with storage.transaction() as tx:
+        finished = tx.finish_reservation(res_id)
+    if not finished:
+        abort(404)
     return redirect(url_for("admin_page"))
 
 @app.route("/admin/toggle-accepting", methods=["POST"])
 def admin_toggle_accepting():
     if not is_admin_authenticated():
         return redirect(url_for("login"))
-    set_accepting_new(not is_accepting_new())
+    with storage.transaction() as tx:
+        tx.set_accepting_new(not tx.is_accepting_new())
     return redirect(url_for("admin_page"))
 
+@app.route("/admin/overload_stats")
+def admin_overload_stats():
+    if not is_admin_polling_authenticated():
+        return jsonify({"error": "unauthorized"}), 401
+    # 上限・カウンタとも同一ホスト上の全ワーカーの合計（内訳は workers）。
+    return jsonify(get_webhook_admission_stats())
+
+@app.route("/admin/profile")
+def admin_profile_page():
+    if not is_admin_authenticated():
+        return redirect(url_for("login"))
+
+    recent = traces.recent_traces(limit=50)
+    for t in recent:
+        t["started"] = time.strftime("%H:%M:%S", time.localtime(t["started_at"]))
+    profiles = profiler.profiles()
+    for p in profiles:
+        p["started"] = time.strftime("%m/%d %H:%M:%S", time.localtime(p["started_at"]))
+    return render_template(
+        "profile.html",
+        profiles=profiles,
+        profiling_running=any(p["running"] for p in profiles),
+        sample_interval=PROFILING_SAMPLE_INTERVAL_SECONDS,
+        max_seconds=PROFILING_MAX_SECONDS,
+        trace_enabled=PROFILING_TRACE_ENABLED,
+        route_stats=traces.route_stats(),
+        traces=recent,
+        pid=os.getpid(),
+        csrf_token=get_csrf_token()
+    )
+
+@app.route("/admin/profile/start", methods=["POST"])
+def admin_profile_start():
+    if not is_admin_authenticated():
+        return redirect(url_for("login"))
+    seconds = request.form.get("seconds", "").strip()
+    duration = min(max(int(seconds), 1), PROFILING_MAX_SECONDS) if seconds.isdigit() else 10
+    if profiler.start(duration):
+        app.logger.info("Sampling profiler started for %s seconds (pid %s)", duration, os.getpid())
+    return redirect(url_for("admin_profile_page"))
+
+@app.route("/admin/profile/stop", methods=["POST"])
+def admin_profile_stop():
+    if not is_admin_authenticated():
+        return redirect(url_for("login"))
+    profiler.stop()
+    return redirect(url_for("admin_profile_page"))
+
+@app.route("/admin/profile/download")
+def admin_profile_download():
+    if not is_admin_authenticated():
+        return redirect(url_for("login"))
+    pid = request.args.get("pid", "").strip()
+    collapsed = profiler.read_collapsed(int(pid) if pid.isdigit() else None)
+    if collapsed is None:
+        return Response("採取結果がありません。採取の完了後に再度ダウンロードしてください。\n",
+                        status=404, mimetype="text/plain")
+    filename = f"profile-{pid or 'latest'}-{time.strftime('%Y%m%d-%H%M%S')}.folded"
+    return Response(
+        collapsed,
+        mimetype="text/plain",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@app.route("/admin/profile/traces")
+def admin_profile_traces():
+    if not is_admin_polling_authenticated():
+        return jsonify({"error": "unauthorized"}), 401
+    return jsonify({
+        "pid": os.getpid(),
+        "profiles": profiler.profiles(),
+        "routes": traces.route_stats(),
+        "traces": traces.recent_traces(),
+    })
+
 # --- LINE Webhook ---
 @app.route("/callback", methods=['POST'])
 def callback():
-    ip = request.remote_addr or "unknown"
-    if is_webhook_rate_limited(ip):
-        abort(429)
-    signature = request.headers.get('X-Line-Signature')
-    if not signature:
-        abort(400)
-    body = request.get_data(as_text=True)
-    try:
-        handler.handle(body, signature)
-    except InvalidSignatureError:
-        abort(400)
+    with traces.trace("callback"):
+        ip = request.remote_addr or "unknown"
+        if is_webhook_rate_limited(ip):
+            abort(429)
+        signature = request.headers.get('X-Line-Signature')
+        if not signature:
+            abort(400)
+        body = request.get_data(as_text=True)
+        try:
+            # 署名検証は instrument_signature_validator により span("signature") として記録される
+            with span("handle"):
+                handler.handle(body, signature)
+        except InvalidSignatureError:
+            abort(400)
     return 'OK'
 
 @handler.add(MessageEvent, message=TextMessage)
@@ -636,138 +845,22 @@ def handle_message(event):
 
 def process_reservation(event, user_id, user_message):
     normalized = user_message.strip()
-    if not normalized:
-        line_bot_api.reply_message(
-            event.reply_token,
-            TextSendMessage(text="メッセージを受け付けました。予約は「予約」、キャンセルは「キャンセル」、到着は「到着」と送信してください。")
-        )
-        return
-    if len(normalized) > MAX_USER_MESSAGE_CHARS:
-        line_bot_api.reply_message(
-            event.reply_token,
-            TextSendMessage(text=f"メッセージは{MAX_USER_MESSAGE_CHARS}文字以内で送信してください。"),
-        )
-        return
-
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            if normalized.startswith('予約'):
-                if not is_accepting_new():
-                    reply = "現在、新規の予約受付は停止中です。"
-                    line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply))
-                    return
-                ensure_types_table()
-                requested_type_name = normalize_type_name(normalized[2:])
-                type_id = None
-                type_name = None
-                if requested_type_name:
-                    if not validate_type_name(requested_type_name):
-                        reply = (
-                            f"種類名は1〜{MAX_TYPE_NAME_LENGTH}文字で指定してください。"
-                            "\n例: 予約 相談"
-                        )
-                        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply))
-                        return
-                    cur.execute("SELECT id, name, accepting FROM reservation_types WHERE name = %s", (requested_type_name,))
-                    type_row = cur.fetchone()
-                    if not type_row:
-                        cur.execute("SELECT name FROM reservation_types WHERE accepting = TRUE ORDER BY id ASC")
-                        names = [r[0] for r in cur.fetchall()]
-                        if names:
-                            reply = f"指定した種類「{requested_type_name}」は存在しません。\n利用可能: " + " / ".join(names)
-                        else:
-                            reply = "予約の種類がまだ登録されていません。管理画面で追加してください。"
-                        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply))
-                        return
-                    type_id, type_name, type_accepting = type_row
-                    if not type_accepting:
-                        cur.execute("SELECT name FROM reservation_types WHERE accepting = TRUE ORDER BY id ASC")
-                        names = [r[0] for r in cur.fetchall()]
-                        if names:
-                            reply = f"「{type_name}」の新規受付は停止中です。\n利用可能: " + " / ".join(names)
-                        else:
-                            reply = f"「{type_name}」の新規受付は停止中です。"
-                        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply))
-                        return
-                else:
-                    cur.execute("SELECT name FROM reservation_types WHERE accepting = TRUE ORDER BY id ASC")
-                    names = [r[0] for r in cur.fetchall()]
-                    if names:
-                        reply = "予約の種類を指定してください。\n利用可能: " + " / ".join(names) + "\n例: 予約 相談"
-                    else:
-                        reply = "現在受付可能な予約の種類がありません。管理画面で受付を再開してください。"
-                    line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply))
-                    return
-
-                cur.execute(
-                    """
-                        SELECT r.id, r.status, t.name
-                        FROM reservations r
-                        LEFT JOIN reservation_types t ON r.type_id = t.id
-                        WHERE r.user_id = %s AND r.status IN ('waiting', 'called', 'arrived')
-                        ORDER BY r.id DESC LIMIT 1
-                    """,
-                    (user_id,)
-                )
-                existing = cur.fetchone()
-                if existing:
-                    res_id, status, existing_type_name = existing
-                    if status == 'waiting':
-                        if existing_type_name:
-                            cur.execute("SELECT COUNT(*) FROM reservations WHERE status = 'waiting' AND id < %s AND type_id = (SELECT type_id FROM reservations WHERE id = %s)", (res_id, res_id))
-                            reply = f"予約済みです。番号: {res_id} / 種類: {existing_type_name} / 待ち: {cur.fetchone()[0]}人"
-                        else:
-                            cur.execute("SELECT COUNT(*) FROM reservations WHERE status = 'waiting' AND id < %s", (res_id,))
-                            reply = f"予約済みです。番号: {res_id} / 待ち: {cur.fetchone()[0]}人"
-                    elif status == 'called':
-                        if existing_type_name:
-                            reply = f"【呼出中】番号: {res_id} / 種類: {existing_type_name} 会場へお越しください！"
-                        else:
-                            reply = f"【呼出中】番号: {res_id} 会場へお越しください！"
-                    else:
-                        if existing_type_name:
-                            reply = f"到着受付済みです。番号: {res_id} / 種類: {existing_type_name} / スタッフが確認します。"
-                        else:
-                            reply = f"到着受付済みです。番号: {res_id} / スタッフが確認します。"
-                else:
-                    cur.execute("INSERT INTO reservations (user_id, message, type_id) VALUES (%s, %s, %s) RETURNING id", (user_id, user_message, type_id))
-                    new_id = cur.fetchone()[0]
-                    conn.commit()
-                    if type_id:
-                        cur.execute("SELECT COUNT(*) FROM reservations WHERE status = 'waiting' AND id < %s AND type_id = %s", (new_id, type_id))
-                        reply = f"【受付完了】番号: {new_id} / 種類: {type_name} / 待ち: {cur.fetchone()[0]}人"
-                    else:
-                        cur.execute("SELECT COUNT(*) FROM reservations WHERE status = 'waiting' AND id < %s", (new_id,))
-                        reply = f"【受付完了】番号: {new_id} / 待ち: {cur.fetchone()[0]}人"
-            elif normalized == 'キャンセル':
-                cur.execute(
-                    "UPDATE reservations SET status = 'cancelled' WHERE id = (SELECT id FROM reservations WHERE user_id = %s AND status IN ('waiting', 'called') ORDER BY id DESC LIMIT 1) RETURNING id",
-                    (user_id,)
-                )
-                cancelled = cur.fetchone()
-                if cancelled:
-                    reply = f"予約番号 {cancelled[0]} をキャンセルしました。"
-                else:
-                    reply = "キャンセル対象の予約はありません。"
-            elif normalized == '到着':
-                cur.execute(
-                    "SELECT id, status FROM reservations WHERE user_id = %s AND status IN ('waiting', 'called') ORDER BY id DESC LIMIT 1",
-                    (user_id,)
-                )
-                existing = cur.fetchone()
-                if not existing:
-                    reply = "到着の対象となる予約がありません。"
-                else:
-                    res_id, status = existing
-                    if status == 'waiting':
-                        reply = "まだ呼出されていません。呼出後に「到着」と送信してください。"
-                    else:
-                        cur.execute("UPDATE reservations SET status = 'arrived' WHERE id = %s", (res_id,))
-                        conn.commit()
-                        reply = f"到着を受け付けました。番号: {res_id} / スタッフが確認します。"
-            else:
-                reply = "メッセージを受け付けました。予約は「予約」、キャンセルは「キャンセル」、到着は「到着」と送信してください。"
-    line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply))
+    # 空・長すぎる・コマンド以外のメッセージはDBも同時実行枠も使わずに返す。
+    reply = precheck_message(normalized)
+    if reply is None:
+        with span("admission"):
+            slot = try_admit_webhook()
+        if slot is None:
+            reply = WEBHOOK_BUSY_MESSAGE
+        else:
+            try:
+                with span("db"):
+                    with storage.transaction() as tx:
+                        reply = run_command(tx, user_id, user_message, normalized)
+            finally:
+                release_webhook(slot)
+    with span("line.reply"):
+        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply))
 
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 5000))
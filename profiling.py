@@ -0,0 +1,270 @@
+"""本番向けの軽量プロファイリング。
+
+- SamplingProfiler: 指定秒数だけ全スレッドのスタックを定期採取し、collapsed stacks
+  （flamegraph.pl / speedscope がそのまま読める形式）で集計して共有ディレクトリに書き出す。
+- trace / span: リクエスト内の処理段階の所要時間を記録し、直近分をリングバッファに保持する。
+
+採取は開始要求を受けたワーカー、トレースは各ワーカーのプロセス内の情報になる。
+"""
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+# --- サンプリングプロファイラ ---
+
+class SamplingProfiler:
+    """採取結果と状態を output_dir にpidごとのファイルとして書き出す。
+
+    gunicornでは開始・停止・ダウンロードが別ワーカーに届くため、状態の参照と停止要求は
+    共有ディレクトリ経由で行う（停止は stop ファイルを置き、採取中のワーカーがそれを見て止まる）。
+    """
+
+    def __init__(self, output_dir: str, interval: float = 0.01):
+        self.output_dir = output_dir
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._stacks = {}
+        self._samples = 0
+        self._started_at = None
+        self._duration = 0.0
+        os.makedirs(output_dir, mode=0o700, exist_ok=True)
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.output_dir, name)
+
+    def _write(self, name: str, data: str):
+        tmp = self._path(f".{name}.{os.getpid()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp, self._path(name))
+
+    def start(self, duration: float) -> bool:
+        """採取を開始する。いずれかのワーカーで採取中なら False。"""
+        with self._lock:
+            if self.running or any(p["running"] for p in self.profiles()):
+                return False
+            try:
+                os.remove(self._path("stop"))
+            except FileNotFoundError:
+                pass
+            self._stacks = {}
+            self._samples = 0
+            self._started_at = time.time()
+            self._duration = duration
+            self._stop.clear()
+            self._write_status(running=True)
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+        return True
+
+    def stop(self):
+        """全ワーカーの採取に停止を要求する。"""
+        self._stop.set()
+        self._write("stop", "")
+
+    def _run(self):
+        own_ident = threading.get_ident()
+        stop_path = self._path("stop")
+        deadline = time.monotonic() + self._duration
+        while (
+            not self._stop.is_set()
+            and time.monotonic() < deadline
+            and not os.path.exists(stop_path)
+        ):
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                key = ";".join(reversed(stack))
+                with self._lock:
+                    self._stacks[key] = self._stacks.get(key, 0) + 1
+            with self._lock:
+                self._samples += 1
+            self._stop.wait(self.interval)
+        with self._lock:
+            self._write(f"profile-{os.getpid()}.folded", self._collapsed())
+            self._write_status(running=False)
+
+    def _write_status(self, running: bool):
+        self._write(f"profile-{os.getpid()}.json", json.dumps({
+            "pid": os.getpid(),
+            "running": running,
+            "started_at": self._started_at,
+            "duration": self._duration,
+            "interval": self.interval,
+            "samples": self._samples,
+            "distinct_stacks": len(self._stacks),
+        }))
+
+    def _collapsed(self) -> str:
+        items = sorted(self._stacks.items(), key=lambda item: item[1], reverse=True)
+        return "".join(f"{stack} {count}\n" for stack, count in items)
+
+    def profiles(self) -> list:
+        """全ワーカーの採取状態（新しい順）。途中で落ちたワーカーの running は期限切れで解除する。"""
+        now = time.time()
+        profiles = []
+        for name in os.listdir(self.output_dir):
+            if not (name.startswith("profile-") and name.endswith(".json")):
+                continue
+            try:
+                with open(self._path(name), encoding="utf-8") as f:
+                    status = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if status["running"] and now > status["started_at"] + status["duration"] + 5:
+                status["running"] = False
+            status["has_output"] = os.path.exists(self._path(f"profile-{status['pid']}.folded"))
+            profiles.append(status)
+        profiles.sort(key=lambda p: p["started_at"] or 0, reverse=True)
+        return profiles
+
+    def read_collapsed(self, pid: int = None):
+        """pid（省略時は最新）の collapsed stacks。まだ無ければ None。"""
+        if pid is None:
+            done = [p for p in self.profiles() if p["has_output"]]
+            if not done:
+                return None
+            pid = done[0]["pid"]
+        try:
+            with open(self._path(f"profile-{int(pid)}.folded"), encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+
+# --- 処理段階のトレース ---
+
+class Trace:
+    __slots__ = ("name", "started_at", "_origin", "duration_ms", "spans", "depth")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started_at = time.time()
+        self._origin = time.perf_counter()
+        self.duration_ms = None
+        self.spans = []
+        self.depth = 0
+
+    def as_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_ms": self.duration_ms,
+            "spans": [
+                {"name": name, "depth": depth, "offset_ms": offset_ms, "duration_ms": duration_ms}
+                for name, depth, offset_ms, duration_ms in sorted(self.spans, key=lambda item: item[2])
+            ],
+        }
+
+
+class TraceRecorder:
+    def __init__(self, capacity: int = 200):
+        self.enabled = True
+        self._traces = deque(maxlen=capacity)
+        self._routes = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def trace(self, name: str):
+        if not self.enabled:
+            yield None
+            return
+        current = Trace(name)
+        token = _current_trace.set(current)
+        try:
+            yield current
+        finally:
+            _current_trace.reset(token)
+            current.duration_ms = round((time.perf_counter() - current._origin) * 1000, 3)
+            with self._lock:
+                self._traces.append(current)
+
+    def recent_traces(self, limit: int = None) -> list:
+        with self._lock:
+            traces = list(self._traces)
+        traces.reverse()
+        if limit is not None:
+            traces = traces[:limit]
+        return [t.as_dict() for t in traces]
+
+    def record_route(self, endpoint: str, duration_ms: float):
+        with self._lock:
+            stats = self._routes.get(endpoint)
+            if stats is None:
+                self._routes[endpoint] = [1, duration_ms, duration_ms]
+            else:
+                stats[0] += 1
+                stats[1] += duration_ms
+                if duration_ms > stats[2]:
+                    stats[2] = duration_ms
+
+    def route_stats(self) -> list:
+        with self._lock:
+            items = [(endpoint, list(stats)) for endpoint, stats in self._routes.items()]
+        return sorted(
+            (
+                {
+                    "endpoint": endpoint,
+                    "count": count,
+                    "avg_ms": round(total / count, 3),
+                    "max_ms": round(max_ms, 3),
+                }
+                for endpoint, (count, total, max_ms) in items
+            ),
+            key=lambda row: row["count"] * row["avg_ms"],
+            reverse=True,
+        )
+
+
+@contextmanager
+def span(name: str):
+    """実行中のトレースに区間を記録する。トレース外では何もしない。"""
+    current = _current_trace.get()
+    if current is None:
+        yield
+        return
+    depth = current.depth
+    current.depth = depth + 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        ended = time.perf_counter()
+        current.depth = depth
+        current.spans.append((
+            name,
+            depth,
+            round((started - current._origin) * 1000, 3),
+            round((ended - started) * 1000, 3),
+        ))
+
+
+def instrument_signature_validator(webhook_handler):
+    """WebhookHandler の署名検証を span("signature") で計測する。"""
+    validator = webhook_handler.parser.signature_validator
+    validate = validator.validate
+
+    def timed_validate(body, signature):
+        with span("signature"):
+            return validate(body, signature)
+
+    validator.validate = timed_validate
@@ -0,0 +1,252 @@
+"""予約キューのオフラインシミュレーション。
+
+実際のコマンド処理（commands.run_command）をインメモリストレージ上で再生し、
+受付・呼出・キャンセルの流量に対する待ち行列の振る舞いをDBなしで見積もる。
+
+    python simulate.py --events 2000000 --types 3 --arrival-rate 600 --call-rate 150
+    python simulate.py --call-rate 0 --auto-call keep_called:20 --tick-seconds 5
+
+レートはすべて「シミュレーション上の1分あたり」の件数。各イベントは
+ポアソン過程として発生し、対象がいないイベント（空の列への呼出など）は空振りとして数える。
+"""
+import argparse
+import json
+import random
+import time
+from bisect import bisect_right
+from itertools import accumulate
+
+from autocall import AutoCaller
+from commands import precheck_message, run_command
+from storage import AUTO_CALL_MODES, MemoryStorage
+
+
+class RandomPool:
+    """O(1) で追加・削除・無作為抽出ができる集合。"""
+
+    def __init__(self):
+        self.items = []
+        self.index = {}
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, item):
+        self.index[item] = len(self.items)
+        self.items.append(item)
+
+    def remove(self, item):
+        pos = self.index.pop(item)
+        last = self.items.pop()
+        if pos < len(self.items):
+            self.items[pos] = last
+            self.index[last] = pos
+
+    def pick(self, rng):
+        return self.items[int(rng.random() * len(self.items))]
+
+
+def send(store, user_id: str, text: str) -> str:
+    normalized = text.strip()
+    reply = precheck_message(normalized)
+    if reply is None:
+        with store.transaction() as tx:
+            reply = run_command(tx, user_id, text, normalized)
+    return reply
+
+
+def percentile(sorted_values, ratio: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * ratio))]
+
+
+def parse_auto_call(value: str):
+    mode, _, amount = value.partition(":")
+    if mode not in AUTO_CALL_MODES or mode == "off" or not amount.isdigit() or int(amount) < 1:
+        raise argparse.ArgumentTypeError("expected keep_called:K or interval:M")
+    return mode, int(amount)
+
+
+def simulate(args) -> dict:
+    rng = random.Random(args.seed)
+    # 自動呼出の間隔計算はシミュレーション上の時刻（秒）で行う
+    sim_seconds = [0.0]
+    store = MemoryStorage(clock=lambda: sim_seconds[0])
+    with store.transaction() as tx:
+        type_ids = [tx.add_type(f"種類{i + 1}") for i in range(args.types)]
+        if args.auto_call:
+            for type_id in type_ids:
+                tx.set_type_auto_call(type_id, *args.auto_call)
+    type_names = {type_id: f"種類{i + 1}" for i, type_id in enumerate(type_ids)}
+
+    kinds = ["arrival", "call", "cancel", "arrive", "finish", "recheck"]
+    rates = [
+        args.arrival_rate,
+        args.call_rate * args.types,
+        args.cancel_rate,
+        args.arrive_rate,
+        args.finish_rate,
+        args.recheck_rate,
+    ]
+    total_rate = sum(rates)
+    if total_rate <= 0:
+        raise SystemExit("at least one rate must be positive")
+    if not args.auto_call and args.call_rate <= 0:
+        raise SystemExit("--call-rate must be positive unless --auto-call is set")
+    cumulative = list(accumulate(rate / total_rate for rate in rates))
+
+    waiting = RandomPool()
+    called = RandomPool()
+    arrived = RandomPool()
+    user_type = {}
+    user_reservation = {}
+    reserved_at = {}
+    waiting_by_type = {type_id: 0 for type_id in type_ids}
+    peak_waiting = dict(waiting_by_type)
+    processed = {kind: 0 for kind in kinds}
+    idle = {kind: 0 for kind in kinds}
+    waits = []
+    auto_called = 0
+    next_user = 0
+    clock = 0.0
+
+    def on_called(user_id, res_id):
+        waiting.remove(user_id)
+        called.add(user_id)
+        user_reservation[user_id] = res_id
+        waiting_by_type[user_type[user_id]] -= 1
+        waits.append(clock - reserved_at.pop(user_id))
+
+    caller = AutoCaller(store, on_called, batch_size=args.batch_size, push_concurrency=0,
+                        called_timeout_seconds=args.called_timeout_minutes * 60)
+    tick_minutes = args.tick_seconds / 60
+    next_tick = tick_minutes
+
+    started = time.perf_counter()
+    for _ in range(args.events):
+        clock += rng.expovariate(total_rate)
+        if args.auto_call:
+            while next_tick <= clock:
+                event_clock, clock = clock, next_tick
+                sim_seconds[0] = next_tick * 60
+                auto_called += caller.tick()
+                clock = event_clock
+                next_tick += tick_minutes
+        kind = kinds[min(bisect_right(cumulative, rng.random()), len(kinds) - 1)]
+
+        if kind == "arrival":
+            next_user += 1
+            user_id = f"U{next_user:010d}"
+            type_id = type_ids[int(rng.random() * len(type_ids))]
+            send(store, user_id, f"予約 {type_names[type_id]}")
+            waiting.add(user_id)
+            user_type[user_id] = type_id
+            reserved_at[user_id] = clock
+            waiting_by_type[type_id] += 1
+            if waiting_by_type[type_id] > peak_waiting[type_id]:
+                peak_waiting[type_id] = waiting_by_type[type_id]
+        elif kind == "call":
+            type_id = type_ids[int(rng.random() * len(type_ids))]
+            with store.transaction() as tx:
+                claimed = tx.claim_waiting(type_id, 1)
+            if not claimed:
+                idle[kind] += 1
+                continue
+            for res_id, user_id in claimed:
+                on_called(user_id, res_id)
+        elif kind == "cancel":
+            pending = len(waiting) + len(called)
+            if not pending:
+                idle[kind] += 1
+                continue
+            pool = waiting if rng.random() * pending < len(waiting) else called
+            user_id = pool.pick(rng)
+            send(store, user_id, "キャンセル")
+            pool.remove(user_id)
+            if pool is waiting:
+                waiting_by_type[user_type[user_id]] -= 1
+                reserved_at.pop(user_id)
+            else:
+                user_reservation.pop(user_id)
+            user_type.pop(user_id)
+        elif kind == "arrive":
+            if not called:
+                idle[kind] += 1
+                continue
+            user_id = called.pick(rng)
+            send(store, user_id, "到着")
+            called.remove(user_id)
+            arrived.add(user_reservation.pop(user_id))
+            user_type.pop(user_id)
+        elif kind == "finish":
+            if not arrived:
+                idle[kind] += 1
+                continue
+            res_id = arrived.pick(rng)
+            with store.transaction() as tx:
+                tx.finish_reservation(res_id)
+            arrived.remove(res_id)
+        else:
+            pending = len(waiting) + len(called)
+            if not pending:
+                idle[kind] += 1
+                continue
+            pool = waiting if rng.random() * pending < len(waiting) else called
+            user_id = pool.pick(rng)
+            send(store, user_id, f"予約 {type_names[user_type[user_id]]}")
+        processed[kind] += 1
+    elapsed = time.perf_counter() - started
+
+    waits.sort()
+    return {
+        "events": args.events,
+        "processed": processed,
+        "idle": idle,
+        "auto_call": {
+            "policy": f"{args.auto_call[0]}:{args.auto_call[1]}" if args.auto_call else None,
+            "called": auto_called,
+        },
+        "wall_seconds": round(elapsed, 3),
+        "events_per_minute": round(args.events / elapsed * 60) if elapsed else None,
+        "simulated_minutes": round(clock, 2),
+        "waiting_now": {type_names[t]: n for t, n in waiting_by_type.items()},
+        "peak_waiting": {type_names[t]: n for t, n in peak_waiting.items()},
+        "called_now": len(called),
+        "arrived_now": len(arrived),
+        "wait_minutes": {
+            "mean": round(sum(waits) / len(waits), 2) if waits else 0.0,
+            "p50": round(percentile(waits, 0.50), 2),
+            "p95": round(percentile(waits, 0.95), 2),
+            "max": round(waits[-1], 2) if waits else 0.0,
+        },
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="予約キューのオフラインシミュレーション")
+    parser.add_argument("--events", type=int, default=1_000_000, help="処理するイベント数")
+    parser.add_argument("--types", type=int, default=3, help="予約の種類の数")
+    parser.add_argument("--arrival-rate", type=float, default=600, help="新規「予約」/分（全体）")
+    parser.add_argument("--call-rate", type=float, default=200, help="スタッフ呼出/分（種類ごと）")
+    parser.add_argument("--cancel-rate", type=float, default=30, help="「キャンセル」/分（全体）")
+    parser.add_argument("--arrive-rate", type=float, default=500, help="「到着」/分（全体）")
+    parser.add_argument("--finish-rate", type=float, default=500, help="確認完了/分（全体）")
+    parser.add_argument("--recheck-rate", type=float, default=100, help="予約済み利用者の再「予約」/分（全体）")
+    parser.add_argument("--auto-call", type=parse_auto_call, default=None,
+                        help="全種類に自動呼出を設定（keep_called:K / interval:M）")
+    parser.add_argument("--tick-seconds", type=float, default=5, help="自動呼出の実行間隔（秒）")
+    parser.add_argument("--batch-size", type=int, default=50, help="自動呼出の1コミットあたりの件数")
+    parser.add_argument("--called-timeout-minutes", type=float, default=10,
+                        help="keep_called で呼出中に数える上限（分、0で無期限）")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    if args.events < 0 or args.types < 1:
+        parser.error("--events must be >= 0 and --types must be >= 1")
+    if args.tick_seconds <= 0:
+        parser.error("--tick-seconds must be positive")
+    print(json.dumps(simulate(args), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
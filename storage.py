@@ -0,0 +1,691 @@
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import deque
+from contextlib import contextmanager
+
+from profiling import span
+
+try:
+    import psycopg2
+except ImportError:  # インメモリ実装だけを使う場合（シミュレーション等）は不要
+    psycopg2 = None
+
+ACTIVE_STATUSES = ("waiting", "called", "arrived")
+HISTORY_STATUSES = ("done", "cancelled", "arrived")
+SORT_COLUMNS = ("id", "status", "type", "message")
+UNSET_TYPE_NAME = "未設定"
+# 自動呼出の方針: keep_called = 呼出中をK人に保つ / interval = M分ごとに1人呼ぶ
+AUTO_CALL_MODES = ("off", "keep_called", "interval")
+
+
+class DuplicateTypeError(Exception):
+    pass
+
+
+def create_storage(backend: str, database_url: str = "", connect_timeout: int = 5):
+    if backend == "postgres":
+        return PostgresStorage(database_url, connect_timeout)
+    if backend == "memory":
+        return MemoryStorage()
+    raise RuntimeError(f"Unknown STORAGE_BACKEND: {backend}")
+
+
+# --- PostgreSQL ---
+
+class PostgresStorage:
+    def __init__(self, database_url: str, connect_timeout: int = 5):
+        if psycopg2 is None:
+            raise RuntimeError("psycopg2 is required for the postgres storage backend")
+        self.database_url = database_url
+        self.connect_timeout = connect_timeout
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+
+    def connect(self):
+        return psycopg2.connect(self.database_url, connect_timeout=self.connect_timeout)
+
+    def ensure_schema(self):
+        """テーブル作成・列追加をプロセスごとに一度だけ、独立したトランザクションで行う。
+
+        ALTER TABLE は列が既にあっても ACCESS EXCLUSIVE ロックを取るため、
+        通常の処理と同じトランザクションでは実行しない。
+        """
+        if self._schema_ready:
+            return
+        with self._schema_lock:
+            if self._schema_ready:
+                return
+            conn = self.connect()
+            try:
+                with conn:
+                    with conn.cursor() as cur:
+                        PostgresTransaction(cur).create_schema()
+            finally:
+                conn.close()
+            self._schema_ready = True
+
+    @contextmanager
+    def transaction(self):
+        self.ensure_schema()
+        with span("db.connect"):
+            conn = self.connect()
+        try:
+            with conn:
+                with conn.cursor() as cur:
+                    yield PostgresTransaction(cur)
+        finally:
+            conn.close()
+
+    def leader_lock(self, key: int):
+        return PostgresLeaderLock(self, key)
+
+
+class PostgresLeaderLock:
+    """セッション単位の advisory lock。
+
+    接続は1本を使い回し、取得に失敗しても閉じない（リトライのたびに新規接続を張らないため）。
+    接続が切れるとロックも解放されるので、is_held で生存確認する。
+    """
+
+    def __init__(self, storage: PostgresStorage, key: int):
+        self.storage = storage
+        self.key = key
+        self.conn = None
+        self.held = False
+
+    def try_acquire(self) -> bool:
+        if self.held:
+            return True
+        try:
+            if self.conn is None or self.conn.closed:
+                self.conn = self.storage.connect()
+                self.conn.autocommit = True
+            with self.conn.cursor() as cur:
+                cur.execute("SELECT pg_try_advisory_lock(%s)", (self.key,))
+                self.held = bool(cur.fetchone()[0])
+        except psycopg2.Error:
+            self._close()
+            raise
+        return self.held
+
+    def is_held(self) -> bool:
+        if not self.held:
+            return False
+        try:
+            with self.conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            return True
+        except psycopg2.Error:
+            self._close()
+            return False
+
+    def release(self):
+        if self.held:
+            try:
+                with self.conn.cursor() as cur:
+                    cur.execute("SELECT pg_advisory_unlock(%s)", (self.key,))
+            except psycopg2.Error:
+                pass
+        self._close()
+
+    def _close(self):
+        self.held = False
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            finally:
+                self.conn = None
+
+
+class PostgresTransaction:
+    def __init__(self, cur):
+        self.cur = cur
+
+    # スキーマ / 設定（create_schema は PostgresStorage.ensure_schema からのみ呼ぶ）
+
+    def create_schema(self):
+        self.cur.execute("""
+            CREATE TABLE IF NOT EXISTS reservation_types (
+                id SERIAL PRIMARY KEY,
+                name TEXT NOT NULL UNIQUE,
+                accepting BOOLEAN NOT NULL DEFAULT TRUE,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        self.cur.execute("""
+            ALTER TABLE reservations
+            ADD COLUMN IF NOT EXISTS type_id INTEGER
+            REFERENCES reservation_types(id) ON DELETE SET NULL
+        """)
+        self.cur.execute("""
+            ALTER TABLE reservation_types
+            ADD COLUMN IF NOT EXISTS accepting BOOLEAN NOT NULL DEFAULT TRUE
+        """)
+        self.cur.execute("""
+            ALTER TABLE reservation_types
+            ADD COLUMN IF NOT EXISTS auto_call_mode TEXT NOT NULL DEFAULT 'off',
+            ADD COLUMN IF NOT EXISTS auto_call_value INTEGER NOT NULL DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS auto_call_last_at TIMESTAMP
+        """)
+        self.cur.execute("""
+            ALTER TABLE reservations
+            ADD COLUMN IF NOT EXISTS called_at TIMESTAMP
+        """)
+        self.cur.execute("""
+            CREATE TABLE IF NOT EXISTS app_settings (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            )
+        """)
+        self.cur.execute("""
+            INSERT INTO app_settings (key, value)
+            VALUES ('accepting_new', 'true')
+            ON CONFLICT (key) DO NOTHING
+        """)
+
+    def is_accepting_new(self) -> bool:
+        self.cur.execute("SELECT value FROM app_settings WHERE key = 'accepting_new'")
+        row = self.cur.fetchone()
+        return bool(row and row[0] == 'true')
+
+    def set_accepting_new(self, flag: bool):
+        self.cur.execute(
+            "UPDATE app_settings SET value = %s WHERE key = 'accepting_new'",
+            ('true' if flag else 'false',)
+        )
+
+    # 種類
+
+    def list_types(self):
+        """(id, name, accepting, auto_call_mode, auto_call_value) の一覧。"""
+        self.cur.execute(
+            "SELECT id, name, accepting, auto_call_mode, auto_call_value FROM reservation_types ORDER BY id ASC"
+        )
+        return self.cur.fetchall()
+
+    def accepting_type_names(self):
+        self.cur.execute("SELECT name FROM reservation_types WHERE accepting = TRUE ORDER BY id ASC")
+        return [r[0] for r in self.cur.fetchall()]
+
+    def get_type_by_name(self, name: str):
+        self.cur.execute("SELECT id, name, accepting FROM reservation_types WHERE name = %s", (name,))
+        return self.cur.fetchone()
+
+    def add_type(self, name: str) -> int:
+        try:
+            self.cur.execute("INSERT INTO reservation_types (name) VALUES (%s) RETURNING id", (name,))
+        except psycopg2.IntegrityError as exc:
+            raise DuplicateTypeError(name) from exc
+        return self.cur.fetchone()[0]
+
+    def delete_type(self, type_id: int):
+        self.cur.execute("DELETE FROM reservation_types WHERE id = %s", (type_id,))
+
+    def toggle_type(self, type_id: int):
+        self.cur.execute("UPDATE reservation_types SET accepting = NOT accepting WHERE id = %s", (type_id,))
+
+    def set_type_auto_call(self, type_id: int, mode: str, value: int):
+        self.cur.execute(
+            "UPDATE reservation_types SET auto_call_mode = %s, auto_call_value = %s WHERE id = %s",
+            (mode, value, type_id)
+        )
+
+    def auto_call_plan(self, called_timeout_seconds: float = 0):
+        """自動呼出が有効な種類の (type_id, mode, value, 呼出中の人数, 前回自動呼出からの秒数またはNone)。
+
+        called_timeout_seconds > 0 のとき、それより前に呼出されたまま到着していない人は人数に含めない。
+        """
+        self.cur.execute("""
+            SELECT t.id, t.auto_call_mode, t.auto_call_value,
+                   (SELECT COUNT(*) FROM reservations r
+                    WHERE r.type_id = t.id AND r.status = 'called'
+                      AND (%s <= 0 OR r.called_at >= CURRENT_TIMESTAMP - %s * INTERVAL '1 second')),
+                   EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - t.auto_call_last_at))
+            FROM reservation_types t
+            WHERE t.auto_call_mode <> 'off' AND t.auto_call_value > 0
+            ORDER BY t.id ASC
+        """, (called_timeout_seconds, called_timeout_seconds))
+        return [
+            (type_id, mode, value, called, float(elapsed) if elapsed is not None else None)
+            for type_id, mode, value, called, elapsed in self.cur.fetchall()
+        ]
+
+    def mark_auto_called(self, type_id: int):
+        self.cur.execute(
+            "UPDATE reservation_types SET auto_call_last_at = CURRENT_TIMESTAMP WHERE id = %s",
+            (type_id,)
+        )
+
+    # 予約一覧
+
+    def list_reservations(self, statuses, type_id=None, sort_by="id", sort_order="asc",
+                          tie_order="asc", limit=None):
+        """(id, user_id, message, status, type_name) の一覧。sort_by / 順序は呼び出し側で検証済みであること。"""
+        order_map = {
+            "id": "r.id",
+            "status": "r.status",
+            "type": "t.name",
+            "message": "r.message"
+        }
+        params = [list(statuses)]
+        where = "WHERE r.status = ANY(%s)"
+        if type_id is not None:
+            where += " AND r.type_id = %s"
+            params.append(type_id)
+        query = f"""
+            SELECT r.id, r.user_id, r.message, r.status, t.name
+            FROM reservations r
+            LEFT JOIN reservation_types t ON r.type_id = t.id
+            {where}
+            ORDER BY {order_map[sort_by]} {sort_order.upper()}, r.id {tie_order.upper()}
+        """
+        if limit is not None:
+            query += " LIMIT %s"
+            params.append(limit)
+        self.cur.execute(query, params)
+        return self.cur.fetchall()
+
+    def active_type_counts(self):
+        self.cur.execute("""
+            SELECT COALESCE(t.name, '未設定') AS name, COUNT(*)
+            FROM reservations r
+            LEFT JOIN reservation_types t ON r.type_id = t.id
+            WHERE r.status IN ('waiting', 'called', 'arrived')
+            GROUP BY COALESCE(t.name, '未設定')
+            ORDER BY COUNT(*) DESC
+        """)
+        return self.cur.fetchall()
+
+    # 利用者の予約
+
+    def latest_active_for_user(self, user_id: str):
+        """(id, status, type_id, type_name) または None。"""
+        self.cur.execute(
+            """
+                SELECT r.id, r.status, r.type_id, t.name
+                FROM reservations r
+                LEFT JOIN reservation_types t ON r.type_id = t.id
+                WHERE r.user_id = %s AND r.status IN ('waiting', 'called', 'arrived')
+                ORDER BY r.id DESC LIMIT 1
+            """,
+            (user_id,)
+        )
+        return self.cur.fetchone()
+
+    def latest_pending_for_user(self, user_id: str):
+        """呼出前後（waiting / called）の最新予約の (id, status) または None。"""
+        self.cur.execute(
+            "SELECT id, status FROM reservations WHERE user_id = %s AND status IN ('waiting', 'called') ORDER BY id DESC LIMIT 1",
+            (user_id,)
+        )
+        return self.cur.fetchone()
+
+    def count_waiting_ahead(self, res_id: int, type_id=None) -> int:
+        if type_id is None:
+            self.cur.execute("SELECT COUNT(*) FROM reservations WHERE status = 'waiting' AND id < %s", (res_id,))
+        else:
+            self.cur.execute(
+                "SELECT COUNT(*) FROM reservations WHERE status = 'waiting' AND id < %s AND type_id = %s",
+                (res_id, type_id)
+            )
+        return self.cur.fetchone()[0]
+
+    def create_reservation(self, user_id: str, message: str, type_id) -> int:
+        self.cur.execute(
+            "INSERT INTO reservations (user_id, message, type_id) VALUES (%s, %s, %s) RETURNING id",
+            (user_id, message, type_id)
+        )
+        return self.cur.fetchone()[0]
+
+    def cancel_latest(self, user_id: str):
+        self.cur.execute(
+            "UPDATE reservations SET status = 'cancelled' WHERE id = (SELECT id FROM reservations WHERE user_id = %s AND status IN ('waiting', 'called') ORDER BY id DESC LIMIT 1) RETURNING id",
+            (user_id,)
+        )
+        row = self.cur.fetchone()
+        return row[0] if row else None
+
+    def mark_arrived(self, res_id: int):
+        self.cur.execute("UPDATE reservations SET status = 'arrived' WHERE id = %s", (res_id,))
+
+    # スタッフ操作
+
+    def call_reservation(self, res_id: int):
+        """waiting の予約を called にして user_id を返す。対象外なら None。"""
+        self.cur.execute(
+            "UPDATE reservations SET status = 'called', called_at = CURRENT_TIMESTAMP WHERE id = %s AND status = 'waiting' RETURNING user_id",
+            (res_id,),
+        )
+        row = self.cur.fetchone()
+        return row[0] if row else None
+
+    def claim_waiting(self, type_id, limit: int):
+        """種類ごとの先頭 limit 件を called にして [(id, user_id)] を返す。"""
+        self.cur.execute(
+            """
+                UPDATE reservations SET status = 'called', called_at = CURRENT_TIMESTAMP
+                WHERE id IN (
+                    SELECT id FROM reservations
+                    WHERE status = 'waiting' AND type_id = %s
+                    ORDER BY id ASC LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, user_id
+            """,
+            (type_id, limit)
+        )
+        return sorted(self.cur.fetchall())
+
+    def finish_reservation(self, res_id: int) -> bool:
+        self.cur.execute(
+            "UPDATE reservations SET status = 'done' WHERE id = %s AND status = 'arrived' RETURNING id",
+            (res_id,),
+        )
+        return self.cur.fetchone() is not None
+
+
+# --- インメモリ ---
+
+class _Reservation:
+    __slots__ = ("id", "user_id", "message", "status", "type_id", "called_at")
+
+    def __init__(self, res_id, user_id, message, status, type_id):
+        self.id = res_id
+        self.user_id = user_id
+        self.message = message
+        self.status = status
+        self.type_id = type_id
+        self.called_at = None
+
+
+class MemoryStorage:
+    """PostgreSQL版と同じ待ち行列の意味論を持つプロセス内ストレージ。
+
+    トランザクションは単一のロックで直列化するだけで、ロールバックはしない。
+    待ち人数は種類別・全体の waiting ID のソート済みリストを二分探索して求める。
+    clock は自動呼出の間隔計算に使う時刻関数（シミュレーションでは仮想時刻を渡す）。
+    """
+
+    def __init__(self, clock=time.time):
+        self._clock = clock
+        self._lock = threading.RLock()
+        self._leader_lock = threading.Lock()
+        self._accepting_new = True
+        self._types = {}
+        self._type_ids_by_name = {}
+        self._next_type_id = 1
+        self._reservations = {}
+        self._next_reservation_id = 1
+        self._active_ids_by_user = {}
+        self._waiting_ids = []
+        self._waiting_ids_by_type = {}
+        # 種類ごとの呼出順の (called_at, id)。自動呼出の「呼出中の人数」を数えるのに使う
+        self._called_by_type = {}
+
+    @contextmanager
+    def transaction(self):
+        with self._lock:
+            yield self
+
+    def leader_lock(self, key: int):
+        # プロセス内でのみ排他する（インメモリのデータ自体がプロセス内にしかないため）
+        return _MemoryLeaderLock(self._leader_lock)
+
+    # 内部ヘルパー
+
+    def _set_status(self, res, status):
+        if res.status == status:
+            return
+        if res.status == "waiting":
+            self._remove_waiting(res)
+        elif status == "waiting":
+            insort(self._waiting_ids, res.id)
+            if res.type_id is not None:
+                insort(self._waiting_ids_by_type.setdefault(res.type_id, []), res.id)
+        if status == "called":
+            res.called_at = self._clock()
+            if res.type_id is not None:
+                self._called_by_type.setdefault(res.type_id, deque()).append((res.called_at, res.id))
+        if status not in ACTIVE_STATUSES:
+            active = self._active_ids_by_user.get(res.user_id)
+            if active:
+                active.remove(res.id)
+                if not active:
+                    del self._active_ids_by_user[res.user_id]
+        res.status = status
+
+    def _remove_waiting(self, res):
+        ids = self._waiting_ids
+        del ids[bisect_left(ids, res.id)]
+        if res.type_id is not None:
+            ids = self._waiting_ids_by_type[res.type_id]
+            del ids[bisect_left(ids, res.id)]
+
+    def _latest_for_user(self, user_id, statuses):
+        for res_id in reversed(self._active_ids_by_user.get(user_id, ())):
+            res = self._reservations[res_id]
+            if res.status in statuses:
+                return res
+        return None
+
+    def _type_name(self, type_id):
+        if type_id is None:
+            return None
+        return self._types[type_id]["name"]
+
+    # 設定
+
+    def is_accepting_new(self) -> bool:
+        return self._accepting_new
+
+    def set_accepting_new(self, flag: bool):
+        self._accepting_new = bool(flag)
+
+    # 種類
+
+    def list_types(self):
+        return [
+            (type_id, t["name"], t["accepting"], t["auto_call_mode"], t["auto_call_value"])
+            for type_id, t in sorted(self._types.items())
+        ]
+
+    def accepting_type_names(self):
+        return [t["name"] for _, t in sorted(self._types.items()) if t["accepting"]]
+
+    def get_type_by_name(self, name: str):
+        type_id = self._type_ids_by_name.get(name)
+        if type_id is None:
+            return None
+        t = self._types[type_id]
+        return (type_id, t["name"], t["accepting"])
+
+    def add_type(self, name: str) -> int:
+        if name in self._type_ids_by_name:
+            raise DuplicateTypeError(name)
+        type_id = self._next_type_id
+        self._next_type_id += 1
+        self._types[type_id] = {
+            "name": name,
+            "accepting": True,
+            "auto_call_mode": "off",
+            "auto_call_value": 0,
+            "auto_call_last_at": None,
+        }
+        self._type_ids_by_name[name] = type_id
+        return type_id
+
+    def delete_type(self, type_id: int):
+        t = self._types.pop(type_id, None)
+        if t is None:
+            return
+        del self._type_ids_by_name[t["name"]]
+        self._waiting_ids_by_type.pop(type_id, None)
+        self._called_by_type.pop(type_id, None)
+        # ON DELETE SET NULL 相当
+        for res in self._reservations.values():
+            if res.type_id == type_id:
+                res.type_id = None
+
+    def toggle_type(self, type_id: int):
+        t = self._types.get(type_id)
+        if t is not None:
+            t["accepting"] = not t["accepting"]
+
+    def set_type_auto_call(self, type_id: int, mode: str, value: int):
+        t = self._types.get(type_id)
+        if t is not None:
+            t["auto_call_mode"] = mode
+            t["auto_call_value"] = value
+
+    def _count_called(self, type_id, cutoff):
+        called = self._called_by_type.get(type_id)
+        if not called:
+            return 0
+        # 先頭の、期限切れまたは呼出中でなくなった分は以後数える必要がないので捨てる
+        while called and (
+            (cutoff is not None and called[0][0] < cutoff)
+            or self._reservations[called[0][1]].status != "called"
+        ):
+            called.popleft()
+        return sum(
+            1 for called_at, res_id in called
+            if self._reservations[res_id].status == "called" and (cutoff is None or called_at >= cutoff)
+        )
+
+    def auto_call_plan(self, called_timeout_seconds: float = 0):
+        now = self._clock()
+        cutoff = now - called_timeout_seconds if called_timeout_seconds > 0 else None
+        return [
+            (
+                type_id,
+                t["auto_call_mode"],
+                t["auto_call_value"],
+                self._count_called(type_id, cutoff),
+                None if t["auto_call_last_at"] is None else now - t["auto_call_last_at"],
+            )
+            for type_id, t in sorted(self._types.items())
+            if t["auto_call_mode"] != "off" and t["auto_call_value"] > 0
+        ]
+
+    def mark_auto_called(self, type_id: int):
+        t = self._types.get(type_id)
+        if t is not None:
+            t["auto_call_last_at"] = self._clock()
+
+    # 予約一覧
+
+    def list_reservations(self, statuses, type_id=None, sort_by="id", sort_order="asc",
+                          tie_order="asc", limit=None):
+        rows = [
+            (res.id, res.user_id, res.message, res.status, self._type_name(res.type_id))
+            for res in self._reservations.values()
+            if res.status in statuses and (type_id is None or res.type_id == type_id)
+        ]
+        rows.sort(key=lambda row: row[0], reverse=(tie_order == "desc"))
+        if sort_by != "id":
+            column = {"status": 3, "type": 4, "message": 2}[sort_by]
+            # PostgreSQLと同じく NULL は昇順で末尾、降順で先頭
+            rows.sort(
+                key=lambda row: (row[column] is None, row[column] or ""),
+                reverse=(sort_order == "desc"),
+            )
+        elif sort_order != tie_order:
+            rows.reverse()
+        if limit is not None:
+            rows = rows[:limit]
+        return rows
+
+    def active_type_counts(self):
+        counts = {}
+        for res_ids in self._active_ids_by_user.values():
+            for res_id in res_ids:
+                name = self._type_name(self._reservations[res_id].type_id) or UNSET_TYPE_NAME
+                counts[name] = counts.get(name, 0) + 1
+        return sorted(counts.items(), key=lambda item: item[1], reverse=True)
+
+    # 利用者の予約
+
+    def latest_active_for_user(self, user_id: str):
+        res = self._latest_for_user(user_id, ACTIVE_STATUSES)
+        if res is None:
+            return None
+        return (res.id, res.status, res.type_id, self._type_name(res.type_id))
+
+    def latest_pending_for_user(self, user_id: str):
+        res = self._latest_for_user(user_id, ("waiting", "called"))
+        if res is None:
+            return None
+        return (res.id, res.status)
+
+    def count_waiting_ahead(self, res_id: int, type_id=None) -> int:
+        if type_id is None:
+            return bisect_left(self._waiting_ids, res_id)
+        return bisect_left(self._waiting_ids_by_type.get(type_id, ()), res_id)
+
+    def create_reservation(self, user_id: str, message: str, type_id) -> int:
+        res_id = self._next_reservation_id
+        self._next_reservation_id += 1
+        res = _Reservation(res_id, user_id, message, "waiting", type_id)
+        self._reservations[res_id] = res
+        self._active_ids_by_user.setdefault(user_id, []).append(res_id)
+        # IDは単調増加なので末尾追加でソート順を保てる
+        self._waiting_ids.append(res_id)
+        if type_id is not None:
+            self._waiting_ids_by_type.setdefault(type_id, []).append(res_id)
+        return res_id
+
+    def cancel_latest(self, user_id: str):
+        res = self._latest_for_user(user_id, ("waiting", "called"))
+        if res is None:
+            return None
+        self._set_status(res, "cancelled")
+        return res.id
+
+    def mark_arrived(self, res_id: int):
+        res = self._reservations.get(res_id)
+        if res is not None:
+            self._set_status(res, "arrived")
+
+    # スタッフ操作
+
+    def call_reservation(self, res_id: int):
+        res = self._reservations.get(res_id)
+        if res is None or res.status != "waiting":
+            return None
+        self._set_status(res, "called")
+        return res.user_id
+
+    def claim_waiting(self, type_id, limit: int):
+        claimed = []
+        for res_id in self._waiting_ids_by_type.get(type_id, ())[:limit]:
+            res = self._reservations[res_id]
+            self._set_status(res, "called")
+            claimed.append((res.id, res.user_id))
+        return claimed
+
+    def finish_reservation(self, res_id: int) -> bool:
+        res = self._reservations.get(res_id)
+        if res is None or res.status != "arrived":
+            return False
+        self._set_status(res, "done")
+        return True
+
+
+class _MemoryLeaderLock:
+    def __init__(self, lock):
+        self._lock = lock
+        self.held = False
+
+    def try_acquire(self) -> bool:
+        if not self.held:
+            self.held = self._lock.acquire(blocking=False)
+        return self.held
+
+    def is_held(self) -> bool:
+        return self.held
+
+    def release(self):
+        if self.held:
+            self.held = False
+            self._lock.release()
@@ -0,0 +1,43 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# リポジトリ直下のモジュール（main / storage / commands / autocall）を import できるようにする
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# main は import 時に環境変数を読むため、DB・LINEなしで動く設定を先に入れておく
+_TMP_DIR = tempfile.mkdtemp(prefix="linebot-tests-")
+for name, value in {
+    "SECRET_KEY": "test-secret-key",
+    "ADMIN_PASSWORD_HASH": "pbkdf2:sha256:1$salt$unused",
+    "CHANNEL_ACCESS_TOKEN": "test-access-token",
+    "CHANNEL_SECRET": "test-channel-secret",
+    "STORAGE_BACKEND": "memory",
+    "FORCE_HTTPS": "false",
+    "SESSION_COOKIE_SECURE": "false",
+    "WEBHOOK_MAX_CONCURRENCY": "1",
+    "WEBHOOK_ADMISSION_DIR": os.path.join(_TMP_DIR, "slots"),
+    "PROFILING_OUTPUT_DIR": os.path.join(_TMP_DIR, "profiles"),
+    "AUTO_CALL_ENABLED": "false",
+}.items():
+    os.environ[name] = value
+
+
+@pytest.fixture
+def main_app():
+    import main
+
+    main.app.config["TESTING"] = True
+    return main
+
+
+@pytest.fixture
+def admin_client(main_app):
+    client = main_app.app.test_client()
+    with client.session_transaction() as sess:
+        now = main_app.time.time()
+        sess.update(logged_in=True, issued_at=now, last_activity=now, _csrf_token="test-csrf")
+        sess.permanent = True
+    return client
@@ -0,0 +1,106 @@
+"""Webhook の同時実行枠（WEBHOOK_MAX_CONCURRENCY=1）が埋まっているときの振る舞い。"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+from contextlib import contextmanager
+
+import pytest
+
+from commands import HELP_MESSAGE
+
+
+def signed_callback(client, text, user_id="U1"):
+    body = json.dumps({
+        "destination": "Uxxxxxxxx",
+        "events": [{
+            "type": "message",
+            "mode": "active",
+            "timestamp": 1700000000000,
+            "source": {"type": "user", "userId": user_id},
+            "webhookEventId": "01TESTEVENT",
+            "deliveryContext": {"isRedelivery": False},
+            "replyToken": "reply-token",
+            "message": {"id": "1", "type": "text", "quoteToken": "q", "text": text},
+        }],
+    })
+    digest = hmac.new(os.environ["CHANNEL_SECRET"].encode(), body.encode(), hashlib.sha256).digest()
+    return client.post(
+        "/callback",
+        data=body,
+        content_type="application/json",
+        headers={"X-Line-Signature": base64.b64encode(digest).decode()},
+    )
+
+
+@pytest.fixture
+def webhook(main_app, monkeypatch):
+    replies = []
+    transactions = []
+    monkeypatch.setattr(
+        main_app.line_bot_api, "reply_message", lambda token, message: replies.append(message.text)
+    )
+    real_transaction = main_app.storage.transaction
+
+    @contextmanager
+    def counting_transaction():
+        transactions.append(1)
+        with real_transaction() as tx:
+            yield tx
+
+    monkeypatch.setattr(main_app.storage, "transaction", counting_transaction)
+    with main_app.storage.transaction() as tx:
+        if not tx.get_type_by_name("相談"):
+            tx.add_type("相談")
+    transactions.clear()
+    return main_app.app.test_client(), replies, transactions
+
+
+def test_command_is_shed_while_slot_is_held(main_app, webhook):
+    client, replies, transactions = webhook
+    before = main_app.get_webhook_admission_stats()
+    slot = main_app.acquire_webhook_slot()
+    assert slot is not None
+    assert main_app.get_webhook_admission_stats()["in_flight"] == 1
+    try:
+        assert signed_callback(client, "予約 相談").status_code == 200
+        assert replies == [main_app.WEBHOOK_BUSY_MESSAGE]
+        assert transactions == []
+
+        # コマンド以外は枠を使わずに返す
+        assert signed_callback(client, "こんにちは").status_code == 200
+        assert replies[-1] == HELP_MESSAGE
+        assert transactions == []
+    finally:
+        main_app.release_webhook(slot)
+
+    stats = main_app.get_webhook_admission_stats()
+    assert stats["shed"] == before["shed"] + 1
+    assert stats["admitted"] == before["admitted"] + 1
+    assert stats["in_flight"] == 0
+    assert stats["max_concurrency"] == 1
+
+
+def test_command_is_admitted_after_release(main_app, webhook):
+    client, replies, transactions = webhook
+    before = main_app.get_webhook_admission_stats()
+
+    assert signed_callback(client, "予約 相談", user_id="U2").status_code == 200
+    assert replies[-1].startswith("【受付完了】")
+    assert transactions == [1]
+
+    stats = main_app.get_webhook_admission_stats()
+    assert stats["admitted"] == before["admitted"] + 1
+    assert stats["shed"] == before["shed"]
+    assert stats["in_flight"] == 0
+    assert stats["peak_in_flight"] == 1
+
+
+def test_overload_stats_endpoint(main_app, admin_client):
+    response = admin_client.get("/admin/overload_stats")
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data["pid"] == os.getpid()
+    assert [w["pid"] for w in data["workers"]] == [os.getpid()]
+    assert main_app.app.test_client().get("/admin/overload_stats").status_code == 401
@@ -0,0 +1,113 @@
+"""calls_due と AutoCaller.tick の振る舞い（仮想時刻の MemoryStorage 上）。"""
+from autocall import AutoCaller, calls_due
+from storage import MemoryStorage
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_caller(mode, value, waiting=10, called_timeout_seconds=600, batch_size=50):
+    clock = FakeClock()
+    store = MemoryStorage(clock=clock)
+    with store.transaction() as tx:
+        type_id = tx.add_type("相談")
+        tx.set_type_auto_call(type_id, mode, value)
+        for i in range(waiting):
+            tx.create_reservation(f"U{i}", "予約 相談", type_id)
+    pushed = []
+    caller = AutoCaller(
+        store,
+        lambda user_id, res_id: pushed.append(res_id),
+        batch_size=batch_size,
+        push_concurrency=0,
+        called_timeout_seconds=called_timeout_seconds,
+    )
+    return store, clock, caller, pushed
+
+
+def test_calls_due():
+    assert calls_due("keep_called", 3, 0, None) == 3
+    assert calls_due("keep_called", 3, 2, None) == 1
+    assert calls_due("keep_called", 3, 5, None) == 0
+    assert calls_due("interval", 2, 0, None) == 1
+    assert calls_due("interval", 2, 0, 119.0) == 0
+    assert calls_due("interval", 2, 0, 120.0) == 1
+    assert calls_due("off", 3, 0, None) == 0
+
+
+def test_keep_called_tops_up_after_arrival():
+    store, clock, caller, pushed = make_caller("keep_called", 3, batch_size=2)
+
+    assert caller.tick() == 3
+    assert pushed == [1, 2, 3]
+    assert caller.tick() == 0
+
+    with store.transaction() as tx:
+        tx.mark_arrived(1)
+        tx.cancel_latest("U1")
+    assert caller.tick() == 2
+    assert pushed == [1, 2, 3, 4, 5]
+
+
+def test_keep_called_ignores_no_shows_after_timeout():
+    store, clock, caller, pushed = make_caller("keep_called", 2, called_timeout_seconds=600)
+    assert caller.tick() == 2
+
+    clock.now += 599
+    assert caller.tick() == 0
+    clock.now += 1
+    assert caller.tick() == 0
+    clock.now += 1
+    assert caller.tick() == 2
+    assert pushed == [1, 2, 3, 4]
+    with store.transaction() as tx:
+        assert [row[0] for row in tx.list_reservations(("called",))] == [1, 2, 3, 4]
+
+
+def test_keep_called_without_timeout_waits_for_no_shows():
+    store, clock, caller, pushed = make_caller("keep_called", 2, called_timeout_seconds=0)
+    assert caller.tick() == 2
+    clock.now += 86400
+    assert caller.tick() == 0
+
+
+def test_interval_calls_one_per_period():
+    store, clock, caller, pushed = make_caller("interval", 2)
+
+    assert caller.tick() == 1
+    assert caller.tick() == 0
+    clock.now += 119
+    assert caller.tick() == 0
+    clock.now += 1
+    assert caller.tick() == 1
+    assert pushed == [1, 2]
+
+
+def test_interval_does_not_restart_period_when_queue_is_empty():
+    store, clock, caller, pushed = make_caller("interval", 2, waiting=1)
+    assert caller.tick() == 1
+    clock.now += 300
+    assert caller.tick() == 0
+
+    with store.transaction() as tx:
+        tx.create_reservation("U9", "予約 相談", 1)
+    # 空振りでは前回時刻を更新しないので、来た人はすぐ呼ばれる
+    assert caller.tick() == 1
+    assert pushed == [1, 2]
+
+
+def test_push_failure_keeps_reservation_called():
+    store, clock, caller, pushed = make_caller("keep_called", 1, waiting=2)
+
+    def failing_push(user_id, res_id):
+        raise RuntimeError("LINE API down")
+
+    caller.push = failing_push
+    assert caller.tick() == 1
+    with store.transaction() as tx:
+        assert tx.latest_pending_for_user("U0") == (1, "called")
@@ -0,0 +1,101 @@
+"""管理セッションのアイドルタイムアウトと、ポーリングAPIでの最終操作時刻更新の間引き。"""
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+
+class FakeTime:
+    """main から見た time モジュール。time() だけ進められる（Cookie署名の検証は実時刻のまま）。"""
+
+    def __init__(self):
+        self.offset = 0.0
+
+    def time(self):
+        return time.time() + self.offset
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+@pytest.fixture
+def clock(main_app, monkeypatch):
+    fake = FakeTime()
+    monkeypatch.setattr(main_app, "time", fake)
+    return fake
+
+
+def last_activity(client):
+    with client.session_transaction() as sess:
+        return sess.get("last_activity")
+
+
+def poll(client):
+    return client.get("/admin/type_counts")
+
+
+def test_poll_inside_interval_does_not_rewrite_session(main_app, admin_client, clock):
+    started = last_activity(admin_client)
+    clock.offset = main_app.SESSION_ACTIVITY_UPDATE_INTERVAL_SECONDS - 5
+
+    response = poll(admin_client)
+    assert response.status_code == 200
+    assert "Set-Cookie" not in response.headers
+    assert last_activity(admin_client) == started
+
+
+def test_poll_after_interval_updates_activity(main_app, admin_client, clock):
+    started = last_activity(admin_client)
+    clock.offset = main_app.SESSION_ACTIVITY_UPDATE_INTERVAL_SECONDS + 1
+
+    response = poll(admin_client)
+    assert response.status_code == 200
+    assert "Set-Cookie" in response.headers
+    assert last_activity(admin_client) == pytest.approx(started + clock.offset, abs=1)
+
+
+def test_poll_after_idle_timeout_is_rejected_even_when_writes_were_throttled(main_app, admin_client, clock):
+    started = last_activity(admin_client)
+    clock.offset = main_app.SESSION_ACTIVITY_UPDATE_INTERVAL_SECONDS - 5
+    assert poll(admin_client).status_code == 200
+    assert last_activity(admin_client) == started
+
+    clock.offset = main_app.SESSION_IDLE_TIMEOUT_SECONDS + 1
+    response = poll(admin_client)
+    assert response.status_code == 401
+    with admin_client.session_transaction() as sess:
+        assert dict(sess) == {}
+    assert poll(admin_client).status_code == 401
+
+
+def test_page_view_always_updates_activity(main_app, admin_client, clock):
+    started = last_activity(admin_client)
+    clock.offset = 5
+
+    assert admin_client.get("/admin").status_code == 200
+    assert last_activity(admin_client) == pytest.approx(started + 5, abs=1)
+
+
+@pytest.mark.parametrize(
+    ("idle_timeout", "requested", "expected"),
+    [("1800", "60", 60), ("100", "60", 50), ("100", "600", 50)],
+)
+def test_update_interval_is_capped_at_half_idle_timeout(idle_timeout, requested, expected):
+    # import 時に決まる値なので、別プロセスで読み込んで確かめる
+    env = dict(
+        os.environ,
+        SESSION_IDLE_TIMEOUT_SECONDS=idle_timeout,
+        SESSION_ACTIVITY_UPDATE_INTERVAL_SECONDS=requested,
+    )
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run(
+        [sys.executable, "-c", "import main; print(main.SESSION_ACTIVITY_UPDATE_INTERVAL_SECONDS)"],
+        cwd=repo_root,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    assert int(output.split()[-1]) == expected
@@ -0,0 +1,116 @@
+"""MemoryStorage と commands.run_command の振る舞い（PostgreSQL版と同じ意味論であること）。"""
+from commands import run_command
+from storage import ACTIVE_STATUSES, HISTORY_STATUSES, MemoryStorage
+
+
+def send(store, user_id, text):
+    with store.transaction() as tx:
+        return run_command(tx, user_id, text, text.strip())
+
+
+def make_store(*type_names):
+    store = MemoryStorage()
+    with store.transaction() as tx:
+        type_ids = [tx.add_type(name) for name in type_names]
+    return store, type_ids
+
+
+def test_reserve_call_arrive_finish():
+    store, (consult,) = make_store("相談")
+
+    assert send(store, "U1", "予約 相談") == "【受付完了】番号: 1 / 種類: 相談 / 待ち: 0人"
+    assert send(store, "U1", "予約 相談") == "予約済みです。番号: 1 / 種類: 相談 / 待ち: 0人"
+    assert send(store, "U1", "到着") == "まだ呼出されていません。呼出後に「到着」と送信してください。"
+
+    with store.transaction() as tx:
+        assert tx.call_reservation(1) == "U1"
+        assert tx.call_reservation(1) is None
+        assert tx.finish_reservation(1) is False
+    assert send(store, "U1", "予約 相談") == "【呼出中】番号: 1 / 種類: 相談 会場へお越しください！"
+
+    assert send(store, "U1", "到着") == "到着を受け付けました。番号: 1 / スタッフが確認します。"
+    assert send(store, "U1", "到着") == "到着の対象となる予約がありません。"
+    with store.transaction() as tx:
+        assert tx.latest_active_for_user("U1") == (1, "arrived", consult, "相談")
+        assert tx.finish_reservation(1) is True
+        assert tx.latest_active_for_user("U1") is None
+        assert tx.list_reservations(("done",)) == [(1, "U1", "予約 相談", "done", "相談")]
+
+    assert send(store, "U1", "予約 相談") == "【受付完了】番号: 2 / 種類: 相談 / 待ち: 0人"
+
+
+def test_cancel_waiting_and_called():
+    store, _ = make_store("相談")
+    send(store, "U1", "予約 相談")
+    send(store, "U2", "予約 相談")
+
+    assert send(store, "U1", "キャンセル") == "予約番号 1 をキャンセルしました。"
+    assert send(store, "U1", "キャンセル") == "キャンセル対象の予約はありません。"
+
+    with store.transaction() as tx:
+        tx.call_reservation(2)
+    assert send(store, "U2", "キャンセル") == "予約番号 2 をキャンセルしました。"
+    with store.transaction() as tx:
+        assert tx.list_reservations(ACTIVE_STATUSES) == []
+        assert [row[0] for row in tx.list_reservations(HISTORY_STATUSES)] == [1, 2]
+
+
+def test_waiting_ahead_after_cancel():
+    store, (consult, other) = make_store("相談", "受取")
+    for user_id, type_name in [("U1", "相談"), ("U2", "受取"), ("U3", "相談"), ("U4", "相談")]:
+        send(store, user_id, f"予約 {type_name}")
+
+    with store.transaction() as tx:
+        assert tx.count_waiting_ahead(4, consult) == 2
+        assert tx.count_waiting_ahead(4) == 3
+    send(store, "U1", "キャンセル")
+    with store.transaction() as tx:
+        assert tx.count_waiting_ahead(4, consult) == 1
+        assert tx.count_waiting_ahead(4) == 2
+        assert tx.count_waiting_ahead(2, other) == 0
+    assert send(store, "U4", "予約 相談") == "予約済みです。番号: 4 / 種類: 相談 / 待ち: 1人"
+
+
+def test_waiting_ahead_after_type_delete():
+    store, (consult, other) = make_store("相談", "受取")
+    for user_id, type_name in [("U1", "相談"), ("U2", "受取"), ("U3", "相談")]:
+        send(store, user_id, f"予約 {type_name}")
+
+    with store.transaction() as tx:
+        tx.delete_type(consult)
+        assert tx.latest_active_for_user("U3") == (3, "waiting", None, None)
+        # 種類を失った予約は全体の待ち人数で数える
+        assert tx.count_waiting_ahead(3) == 2
+        assert tx.count_waiting_ahead(2, other) == 0
+    assert send(store, "U3", "予約 受取") == "予約済みです。番号: 3 / 待ち: 2人"
+
+    send(store, "U1", "キャンセル")
+    with store.transaction() as tx:
+        assert tx.count_waiting_ahead(3) == 1
+        assert tx.call_reservation(3) == "U3"
+        assert tx.count_waiting_ahead(4) == 1
+    assert send(store, "U3", "到着") == "到着を受け付けました。番号: 3 / スタッフが確認します。"
+
+
+def test_list_reservations_orders_null_type_like_postgres():
+    store, (consult, other) = make_store("相談", "受取")
+    send(store, "U1", "予約 受取")
+    send(store, "U2", "予約 相談")
+    send(store, "U3", "予約 受取")
+    send(store, "U4", "予約 相談")
+    with store.transaction() as tx:
+        tx.delete_type(consult)
+        tx.add_type("相談")
+
+        def ids(**kwargs):
+            return [row[0] for row in tx.list_reservations(ACTIVE_STATUSES, **kwargs)]
+
+        assert ids() == [1, 2, 3, 4]
+        assert ids(sort_order="desc", tie_order="desc") == [4, 3, 2, 1]
+        # NULL は昇順で末尾、降順で先頭
+        assert ids(sort_by="type") == [1, 3, 2, 4]
+        assert ids(sort_by="type", tie_order="desc") == [3, 1, 4, 2]
+        assert ids(sort_by="type", sort_order="desc") == [2, 4, 1, 3]
+        assert ids(sort_by="type", limit=3) == [1, 3, 2]
+        assert ids(type_id=other) == [1, 3]
+        assert tx.active_type_counts() == [("受取", 2), ("未設定", 2)]